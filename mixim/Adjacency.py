@@ -0,0 +1,82 @@
+import numpy as np
+
+
+class Adjacency:
+    """
+    Mix adjacency over integer mix indices (positions in Network.mixes): the neighbors of mix i
+    are indices[start[i]:stop[i]]. With start = indptr[:-1] and stop = indptr[1:] this is plain
+    CSR; rows may also share a slice, so a layered topology stores every layer only once.
+    """
+
+    def __init__(self, start, stop, indices):
+        self.start = np.asarray(start, dtype=np.int64)
+        self.stop = np.asarray(stop, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+
+    @classmethod
+    def from_csr(cls, indptr, indices):
+        return cls(indptr[:-1], indptr[1:], indices)
+
+    @classmethod
+    def layered(cls, layer_sizes):
+        """Every mix of a layer links to all mixes of the next layer, the last layer to the first."""
+        layer_start = np.concatenate([[0], np.cumsum(layer_sizes)])
+        next_layer = np.roll(np.arange(len(layer_sizes)), -1)
+        layer_of = np.repeat(np.arange(len(layer_sizes)), layer_sizes)
+        return cls(layer_start[next_layer][layer_of], layer_start[next_layer + 1][layer_of], np.arange(layer_start[-1]))
+
+    @classmethod
+    def empty(cls, n):
+        return cls(np.zeros(n), np.zeros(n), [])
+
+    def degree(self, nodes):
+        return self.stop[nodes] - self.start[nodes]
+
+    def neighbors(self, node):
+        return self.indices[self.start[node]:self.stop[node]]
+
+    def count_neighbors(self, node, nodes):
+        """How many of nodes are neighbors of node."""
+        return int(np.isin(nodes, self.neighbors(node)).sum())
+
+    def sample(self, node, u):
+        """Neighbor of node picked by a uniform variate u in [0, 1)."""
+        start, degree = self.start[node], self.stop[node] - self.start[node]
+        if not degree:
+            raise ValueError(f"Mix {node} has no neighbors")
+        return int(self.indices[start + min(int(u * degree), degree - 1)])
+
+    def sample_many(self, nodes, u):
+        degree = self.degree(nodes)
+        if not degree.all():
+            raise ValueError("Mix without neighbors on a route")
+        return self.indices[self.start[nodes] + np.minimum((u * degree).astype(np.int64), degree - 1)]
+
+
+class CompleteAdjacency:
+    """Fully connected mixes: every mix links to the n - 1 others, and no edge is stored."""
+
+    def __init__(self, n):
+        self.n = n
+
+    def degree(self, nodes):
+        return np.full(np.shape(nodes), self.n - 1)
+
+    def neighbors(self, node):
+        return np.delete(np.arange(self.n), node)
+
+    def count_neighbors(self, node, nodes):
+        return sum(other != node for other in nodes)
+
+    def sample(self, node, u):
+        if self.n < 2:
+            raise ValueError("A single mix has no neighbors")
+        # uniform rank among the others, skipping node itself
+        other = min(int(u * (self.n - 1)), self.n - 2)
+        return other + (other >= node)
+
+    def sample_many(self, nodes, u):
+        if self.n < 2:
+            raise ValueError("A single mix has no neighbors")
+        other = np.minimum((u * (self.n - 1)).astype(np.int64), self.n - 2)
+        return other + (other >= nodes)
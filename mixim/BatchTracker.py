@@ -1,10 +1,14 @@
 
 from collections import defaultdict, Counter
+from bisect import bisect_left
+import math
 import time, calendar
 import logging
 import psutil
 import sys
 import os
+import numpy as np
+from scipy.optimize import linear_sum_assignment
 
 # Add logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,17 +26,40 @@ out_batch_mapping_count = defaultdict(Counter)
 out_msg_mapping_set = {} 
 anonymity_set = {}
 anonymity_set_size = {}
+known_links = {} # out_msg_id -> in_msg_id, links revealed by corrupt mixes
+linked_incoming = set() # in_msg_ids whose outgoing message is known
+relinked_in_batches = set() # incoming batches with new linked_incoming messages, not yet in the MAP rows
+latest_send_time = {} # out_msg_id -> time before which the message must have been sent
 msg_count = 0
 window_size = 1 # number of messages after which to log metrics
 window_index = 0
+delta_logging = False # only log outgoing batches whose probabilities changed; such logs need Metrics.read_batch_logs
+logged_batch_prob = {} # out_batch_id -> batch_prob as last logged
 last_metrics_save_time = 0
 metrics_save_interval = 0.2 # make it 0.2 later. 1 sim time units; set to 3600 seconds for 1 hour; set to 7200 for 2 hours
+map_mode = False # find the most likely joint batch assignment instead of enumerating valids
+tracking = True # run the matcher on every received message; off when only recording observations
+observation_log = None # list of observation events (see Observation.py) while recording a trace
+SENT = 0
+RECEIVED = 1
+CONSTRAINT = 2
 
 def compute_batch_permutations(self, message):
     try:
         batchtracking_start_time = time.time()
         global valids, msg_count, window_index, last_metrics_save_time
+        if not tracking:
+            return
+        if map_mode:
+            compute_map_assignment(self, message)
+            return
         logger.info(f"==>> window_size: {window_size} ===> metrics_save_interval: {metrics_save_interval}")
+        # Clear data structures from the previous message; batch_prob is kept
+        # until the next call so callers can read the latest probabilities
+        out_batch_mapping_count.clear()
+        batch_prob.clear()
+        anonymity_set.clear()
+        anonymity_set_size.clear()
         msg_count += 1
         out_batch_id = message.outgoing_batch_id
         out_msg_id = message.outgoing_msg_id
@@ -45,6 +72,9 @@ def compute_batch_permutations(self, message):
         logger.info(f"==>> OutBatchID: {out_batch_id} ===> IncBatchID: {true_in_batch_id}")
         logger.info(f"==>> OutMsgTime: {out_msg_time}")
         logger.info(f"==>> Incoming Batches: {incoming_batches}")
+        # Corrupt-mix knowledge narrows the candidates before any enumeration
+        linked_in_msg = known_links.get(out_msg_id)
+        send_deadline = min(out_msg_time, latest_send_time.get(out_msg_id, out_msg_time))
 
         for in_batch_id in incoming_batches:
             len_in = len(incoming_batches[in_batch_id])
@@ -56,7 +86,11 @@ def compute_batch_permutations(self, message):
         for in_batch_id in out_batch_mapping_count[out_batch_id]:
             for inc_msg_id, time_left in incoming_batches[in_batch_id].items():
                 # print(f"==>> Time Left[{inc_msg_id}]: {time_left}")
-                if time_left < out_msg_time:
+                if time_left < send_deadline:
+                    if linked_in_msg is not None and inc_msg_id != linked_in_msg:
+                        continue
+                    if linked_in_msg is None and inc_msg_id in linked_incoming:
+                        continue
                     # print(f"==>> OutMsgMappingSet[{out_msg_id}]: {inc_msg_id} Added ")
                     out_msg_mapping_set[out_msg_id].add(inc_msg_id)
 
@@ -152,25 +186,9 @@ def compute_batch_permutations(self, message):
         logger.info(f"============ TIME NOW: {sim_timestamp }, UTC (seconds since epoch): {utc_timestamp} ================")
         if msg_count % window_size == 0:
             window_index += 1
-            for out_batch in batch_prob:
-                self.simulation.Metrics.add_batch_log(
-                    out_batch_id=out_batch,
-                    true_in_batch_id= outgoing_to_incoming_batch_map.get(out_batch, None),
-                    anonymity_set_size=anonymity_set_size.get(out_batch, 0),
-                    anonymity_set=anonymity_set.get(out_batch, set()),
-                    batch_prob=batch_prob.get(out_batch, {}),
-                    sim_timestamp= sim_timestamp, 
-                    utc_timestamp=utc_timestamp,
-                    window_index=window_index,
-                    n_clients=self.simulation.n_clients if hasattr(self.simulation, "n_clients") else None,
-                    batch_size=self.simulation.batch_size if hasattr(self.simulation, "batch_size") else None
-                )
+            log_window(self, sim_timestamp, utc_timestamp)
         # periodic save of metrics
-        if sim_timestamp - last_metrics_save_time >= metrics_save_interval:
-            job_id = os.environ.get("SLURM_JOB_ID", "")
-            filename_suffix = f"_{job_id}_{int(sim_timestamp)}"
-            self.simulation.Metrics.save(self.simulation.logDir, filename_suffix)
-            last_metrics_save_time = sim_timestamp
+        save_metrics(self, sim_timestamp)
         
         # end of metrics logging
         # Batch analysis
@@ -187,17 +205,246 @@ def compute_batch_permutations(self, message):
         logger.info(f"[{out_msg_id}-{true_in_msg_id}]MEMORY - VMS: {memory_info.vms / 1024 / 1024:.2f} MB")
         logger.info(f"[{out_msg_id}-{true_in_msg_id}]MEMORY - ValidsSizeEstimate: {sys.getsizeof(valids) / 1024:.2f} KB")
         logger.info(f"[{out_msg_id}-{true_in_msg_id}]MEMORY - BatchProbSizeEstimate: {sys.getsizeof(batch_prob) / 1024:.2f} KB")
-
-        # Clear data structures for next message
-        out_batch_mapping_count.clear()
-        batch_prob.clear()
-        anonymity_set.clear()
-        anonymity_set_size.clear()
     except Exception as e:
         logger.error(f"Error processing message {out_msg_id}: {str(e)}")
         logger.error(f"Message details: OutBatch={out_batch_id}, InBatch={true_in_batch_id}")
         raise  # Re-raise to not hide the error
 
+def log_window(self, sim_timestamp, utc_timestamp):
+    # Without delta_logging every outgoing batch is logged in every window. With it, only
+    # batches whose probabilities changed since they were last logged are written ("set"),
+    # batches that dropped out are written once as "del", and a window with no change gets a
+    # single "tick" row so its timestamps survive. Metrics.read_batch_logs rebuilds the full
+    # per-window snapshots from this.
+    changed = [out_batch for out_batch in batch_prob
+               if not delta_logging or logged_batch_prob.get(out_batch) != batch_prob[out_batch]]
+    removed = [out_batch for out_batch in logged_batch_prob if out_batch not in batch_prob] if delta_logging else []
+    for out_batch in changed:
+        log_batch(self, out_batch, batch_prob[out_batch], sim_timestamp, utc_timestamp, "set" if delta_logging else None)
+        if delta_logging:
+            logged_batch_prob[out_batch] = batch_prob[out_batch]
+    for out_batch in removed:
+        log_batch(self, out_batch, {}, sim_timestamp, utc_timestamp, "del")
+        del logged_batch_prob[out_batch]
+    if delta_logging and not changed and not removed:
+        log_batch(self, None, {}, sim_timestamp, utc_timestamp, "tick")
+
+def log_batch(self, out_batch, probabilities, sim_timestamp, utc_timestamp, delta_op):
+    self.simulation.Metrics.add_batch_log(
+        out_batch_id=out_batch,
+        true_in_batch_id= outgoing_to_incoming_batch_map.get(out_batch, None),
+        anonymity_set_size=anonymity_set_size.get(out_batch, 0) if probabilities else 0,
+        anonymity_set=anonymity_set.get(out_batch, set()) if probabilities else set(),
+        batch_prob=probabilities,
+        sim_timestamp= sim_timestamp, 
+        utc_timestamp=utc_timestamp,
+        window_index=window_index,
+        n_clients=self.simulation.n_clients if hasattr(self.simulation, "n_clients") else None,
+        batch_size=self.simulation.batch_size if hasattr(self.simulation, "batch_size") else None,
+        delta_op=delta_op
+    )
+
+def save_metrics(self, sim_timestamp):
+    global last_metrics_save_time
+    if sim_timestamp - last_metrics_save_time >= metrics_save_interval:
+        self.simulation.Metrics.flush(self.simulation.logDir, self.simulation.log_suffix)
+        last_metrics_save_time = sim_timestamp
+
+class MapAssignment:
+    """Batch-level compatibility matrix of log match counts, kept across updates."""
+    INFEASIBLE = -1e9
+
+    def __init__(self):
+        self.out_ids = []
+        self.in_ids = []
+        self.rows = {}  # out_batch_id -> row
+        self.cols = {}  # in_batch_id -> column
+        self.weights = np.full((16, 16), self.INFEASIBLE)
+        self.feasible = np.zeros(16, dtype=bool)  # rows with at least one compatible incoming batch
+
+    def update_row(self, out_batch_id, log_weights):
+        for in_batch_id in log_weights:
+            if in_batch_id not in self.cols:
+                self.cols[in_batch_id] = len(self.in_ids)
+                self.in_ids.append(in_batch_id)
+        if out_batch_id not in self.rows:
+            self.rows[out_batch_id] = len(self.out_ids)
+            self.out_ids.append(out_batch_id)
+        self.grow(len(self.out_ids), len(self.in_ids))
+        row = self.rows[out_batch_id]
+        self.weights[row, :] = self.INFEASIBLE
+        if log_weights:
+            self.weights[row, [self.cols[in_id] for in_id in log_weights]] = list(log_weights.values())
+        self.feasible[row] = bool(log_weights)
+
+    def rows_using(self, in_batch_ids):
+        """Outgoing batches whose row has a compatible entry for any of in_batch_ids."""
+        cols = [self.cols[in_id] for in_id in in_batch_ids if in_id in self.cols]
+        if not cols:
+            return []
+        rows = np.flatnonzero((self.weights[:len(self.out_ids), cols] > self.INFEASIBLE).any(axis=1))
+        return [self.out_ids[row] for row in rows]
+
+    def grow(self, n_rows, n_cols):
+        rows, cols = self.weights.shape
+        if n_rows <= rows and n_cols <= cols:
+            return
+        weights = np.full((max(rows, 2 * n_rows), max(cols, 2 * n_cols)), self.INFEASIBLE)
+        weights[:rows, :cols] = self.weights
+        feasible = np.zeros(weights.shape[0], dtype=bool)
+        feasible[:rows] = self.feasible
+        self.weights, self.feasible = weights, feasible
+
+    def solve(self):
+        """Returns {out_batch_id: (in_batch_id, log match count)} for the most likely joint assignment."""
+        rows = np.flatnonzero(self.feasible[:len(self.out_ids)])
+        if len(rows) == 0:
+            return {}
+        weights = self.weights[rows, :len(self.in_ids)]
+        assigned_rows, assigned_cols = linear_sum_assignment(weights, maximize=True)
+        return {self.out_ids[rows[row]]: (self.in_ids[col], float(weights[row, col]))
+                for row, col in zip(assigned_rows, assigned_cols) if weights[row, col] > self.INFEASIBLE}
+
+map_assignment = MapAssignment()
+
+def compute_map_assignment(self, message):
+    # Most likely joint batch assignment under the model used for valids: every valid
+    # message-level matching is equally likely, so an assignment of outgoing to incoming
+    # batches has likelihood prod(count(out, in)) over its pairs, where count is the number
+    # of ways the messages of out can be matched into in. Maximising the sum of log counts
+    # is a weighted bipartite matching, solved without enumerating valids.
+    global msg_count, window_index
+    map_start_time = time.time()
+    msg_count += 1
+    out_batch_id = message.outgoing_batch_id
+    # Incoming messages sent after a row was computed can never match the messages in it,
+    # so only the row of the batch that just received a message needs recomputing, plus the
+    # rows that still count a newly linked incoming message as a candidate
+    stale = set(map_assignment.rows_using(relinked_in_batches))
+    relinked_in_batches.clear()
+    stale.add(out_batch_id)
+    for out_id in sorted(stale):
+        map_assignment.update_row(out_id, batch_log_weights(out_id))
+    map_guess = map_assignment.solve()
+    joint_correct = all(map_guess.get(out_id, (None,))[0] == outgoing_to_incoming_batch_map.get(out_id)
+                        for out_id in map_assignment.out_ids)
+    logger.info(f"==>> MAP OutBatch {out_batch_id} -> {map_guess.get(out_batch_id)} JointCorrect: {joint_correct}")
+
+    utc_timestamp = calendar.timegm(time.gmtime())
+    sim_timestamp = self.env.now
+    if msg_count % window_size == 0:
+        window_index += 1
+        for out_id in map_assignment.out_ids:
+            map_in_batch_id, map_log_likelihood = map_guess.get(out_id, (None, None))
+            self.simulation.Metrics.add_map_log(
+                out_batch_id=out_id,
+                true_in_batch_id=outgoing_to_incoming_batch_map.get(out_id, None),
+                map_in_batch_id=map_in_batch_id,
+                map_log_likelihood=map_log_likelihood,
+                joint_correct=joint_correct,
+                sim_timestamp=sim_timestamp,
+                utc_timestamp=utc_timestamp,
+                window_index=window_index,
+                n_clients=self.simulation.n_clients if hasattr(self.simulation, "n_clients") else None,
+                batch_size=self.simulation.batch_size if hasattr(self.simulation, "batch_size") else None
+            )
+    save_metrics(self, sim_timestamp)
+    logger.info(f"[{message.outgoing_msg_id}]MAP_ANALYSIS - OutBatches: {len(map_assignment.out_ids)} "
+                f"InBatches: {len(map_assignment.in_ids)} ProcessingTime: {time.time() - map_start_time:.4f}s")
+
+def batch_log_weights(out_batch_id):
+    # log of the number of injective matchings of the messages of out_batch_id into each incoming batch
+    linked = []
+    deadlines = []
+    for out_msg_id, out_msg_time in outgoing_batches[out_batch_id].items():
+        deadline = min(out_msg_time, latest_send_time.get(out_msg_id, out_msg_time))
+        if out_msg_id in known_links:
+            linked.append((known_links[out_msg_id], deadline))
+        else:
+            deadlines.append(deadline)
+    deadlines.sort()
+    weights = {}
+    for in_batch_id, in_msgs in incoming_batches.items():
+        if len(in_msgs) < len(outgoing_batches[out_batch_id]):
+            continue
+        if any(in_msgs.get(in_msg_id, math.inf) >= deadline for in_msg_id, deadline in linked):
+            continue
+        # Candidate sets of the remaining messages are nested (sent before each deadline),
+        # so the j-th earliest deadline has (candidates - j) choices left
+        times = sorted(time_left for in_msg_id, time_left in in_msgs.items() if in_msg_id not in linked_incoming)
+        log_count = 0.0
+        for j, deadline in enumerate(deadlines):
+            choices = bisect_left(times, deadline) - j
+            if choices <= 0:
+                break
+            log_count += math.log(choices)
+        else:
+            weights[in_batch_id] = log_count
+    return weights
+
+def claim_incoming_batch():
+    global next_incoming_batch_id
+    batch_id = next_incoming_batch_id
+    next_incoming_batch_id += 1
+    return batch_id
+
+def record_sent(batch_id, msg_id, time_left):
+    if batch_id not in incoming_batches:
+        incoming_batches[batch_id] = {}
+    incoming_batches[batch_id][msg_id] = time_left
+    if observation_log is not None:
+        observation_log.append((SENT, batch_id, -1, msgid(msg_id), time_left))
+
+def outgoing_batch_for(incoming_batch_id):
+    # The first message of an incoming batch to reach its receiver opens a new outgoing batch;
+    # returns (out_batch_id, whether the mapping was created now)
+    global next_outgoing_batch_id
+    if incoming_batch_id in incoming_outgoing_batch_map:
+        return incoming_outgoing_batch_map[incoming_batch_id], False
+    out_batch_id = next_outgoing_batch_id
+    next_outgoing_batch_id += 1
+    incoming_outgoing_batch_map[incoming_batch_id] = out_batch_id
+    if out_batch_id not in outgoing_to_incoming_batch_map:
+        outgoing_to_incoming_batch_map[out_batch_id] = incoming_batch_id
+    return out_batch_id, True
+
+def record_received(out_batch_id, out_msg_id, time_received):
+    if out_batch_id not in outgoing_batches:
+        outgoing_batches[out_batch_id] = {}
+    outgoing_batches[out_batch_id][out_msg_id] = time_received
+    if observation_log is not None:
+        in_batch_id = outgoing_to_incoming_batch_map.get(out_batch_id, -1)
+        observation_log.append((RECEIVED, in_batch_id, out_batch_id, msgid(out_msg_id), time_received))
+
+def add_link_constraint(out_msg_id, in_msg_id=None, sent_before=None):
+    # Hard constraints learned from corrupt mixes: the exact incoming message of out_msg_id,
+    # and/or a time before which it must have left its sender
+    if in_msg_id is not None:
+        known_links[out_msg_id] = in_msg_id
+        linked_incoming.add(in_msg_id)
+        relinked_in_batches.add(batchid(in_msg_id))
+    if sent_before is not None:
+        latest_send_time[out_msg_id] = min(sent_before, latest_send_time.get(out_msg_id, sent_before))
+    if observation_log is not None:
+        # An outgoing message keeps the number of its incoming one, so msg_no names both
+        observation_log.append((CONSTRAINT, batchid(in_msg_id) if in_msg_id is not None else -1, batchid(out_msg_id),
+                                msgid(out_msg_id), sent_before if sent_before is not None else math.inf))
+
+def reset():
+    # Forget all tracked traffic so several runs can share one process
+    global next_incoming_batch_id, next_outgoing_batch_id, valids, msg_count, window_index, last_metrics_save_time
+    next_incoming_batch_id = 0
+    next_outgoing_batch_id = 0
+    for state in (incoming_batches, outgoing_batches, incoming_outgoing_batch_map, outgoing_to_incoming_batch_map,
+                  batch_prob, out_batch_mapping_count, out_msg_mapping_set, anonymity_set, anonymity_set_size,
+                  known_links, linked_incoming, relinked_in_batches, latest_send_time, logged_batch_prob):
+        state.clear()
+    map_assignment.__init__()
+    valids = []
+    msg_count = 0
+    window_index = 0
+    last_metrics_save_time = 0
+
 def batchid(msg):
     parts = msg.split('_')
     return int(parts[1])
@@ -1,15 +1,14 @@
-from random import choice, sample
-from Message import Message
-from numpy.random import exponential
-import numpy as np
-import random
+from Message import Message, NO_TARGETS
 import itertools
+from util import VariateBuffer
+from RouteSampler import RouteBuffer
 from BatchTracker import (incoming_batches, 
-                          next_incoming_batch_id, 
-                          outgoing_batches, 
-                          next_outgoing_batch_id, 
-                          incoming_outgoing_batch_map, 
-                          outgoing_to_incoming_batch_map,
+                          outgoing_batches,
+                          claim_incoming_batch, 
+                          record_sent, 
+                          outgoing_batch_for, 
+                          record_received, 
+                          add_link_constraint,
                           compute_batch_permutations,
                           )
 
@@ -22,7 +21,9 @@ class Client:
         self.class_ends = self.env.event()
         self.mu = mu  # Avg delay: for delays at the poisson mixes
         self.probability_dist_mixes = probability_dist_mixes
-        self.other_clients = set()
+        self.other_clients = []  # set by Simulation.link_clients
+        self.rng = simulation.spawn_rng()
+        self.variates = VariateBuffer(self.rng)
         self.message_id = 1
         #batch-algorithm
         self.current_batch_id = None
@@ -49,111 +50,102 @@ class Client:
         if self.simulation.topology == 'free route':
             for layer in range(1, len(self.network_dict) + 1):
                 self.all_mixes += self.network_dict[layer]
-        self.env.process(self.send_message('Real', self.rate_client))
+        # Source routes are drawn in blocks by the network's RouteSampler
+        sampler = self.simulation.network.route_sampler
+        mixes = self.simulation.network.mixes
+        if self.simulation.topology == 'stratified':
+            n_route_hops = self.simulation.n_layers if self.simulation.routing == 'source' else 1
+            self.routes = RouteBuffer(mixes, lambda size: sampler.stratified(self.rng, size, n_route_hops))
+        elif self.simulation.topology == 'cyclic_stratified':
+            self.routes = RouteBuffer(mixes, lambda size: sampler.cyclic(self.rng, size))
+        elif self.simulation.topology == 'free route' and self.simulation.routing == 'source':
+            self.routes = RouteBuffer(mixes, lambda size: sampler.distinct(self.rng, size, self.n_hops))
+        # Sending starts once all clients exist, as receivers are drawn from other_clients
+        self.send_rates = {'Real': self.rate_client, 'ClientDummy': self.rate_client_dummies}
+        self.simulation.call_later(0, self.send_message, 'Real')
         if self.client_dummies:
-            self.env.process(self.send_message('ClientDummy', self.rate_client_dummies))
+            self.simulation.call_later(0, self.send_message, 'ClientDummy')
 
     def create_message(self, message_type, rate_client):
         assert self.current_batch_receiver is not None, "Receiver for batch not set!"
-        np.random.seed()
-        delay_client = exponential(rate_client)
+        variates = self.variates
+        delay_client = variates.exponential(rate_client)
         route = [self]
         route_ids = [self.id]
         delays = [delay_client]
-        pr_target = [0.0 for _ in range(self.n_targets)]
+        pr_target = NO_TARGETS
         
         if (self.simulation.topology == 'free route' and 
             self.simulation.routing == 'source'):
             # self.n_hops = np.random.randint(2, 6)  
-            for _ in range(self.n_hops):
-                delay_per_mix = exponential(self.mu)
+            for node in self.routes.next():
+                delay_per_mix = variates.exponential(self.mu)
                 delays.append(delay_per_mix)
-                node = choice(self.all_mixes)  
-                while node in route:
-                    node = choice(self.all_mixes)
                 route.append(node)
                 route_ids.append(node.id)
-            print(f"[Free Route Debug] Route: {route}")
+            if self.simulation.printing:
+                print(f"[Free Route Debug] Route: {route}")
             
         elif (self.simulation.topology == 'ba topology' and 
             self.simulation.routing == 'source'):
-            current_node = random.choice(self.all_mixes)
-            # Append the first node to the route
-            route.append(current_node)
-            route_ids.append(current_node.id)
+            network = self.simulation.network
+            current = variates.choice(self.all_mixes).index
+            visited = [current]  # mix indices on the route
             # For each hop in the path, choose one random neighbor
             for _ in range(self.n_hops - 1):
-                neighbors = list(current_node.neighbors)
-                if not neighbors:
+                # avoid repeating nodes: draw uniformly among the neighbors and redraw visited ones
+                if network.adjacency.degree(current) == network.adjacency.count_neighbors(current, visited):
                     break
-                node_next = random.choice(neighbors)
-                # avoid repeating nodes
-                while node_next in route:
-                    node_next = random.choice(neighbors)
+                node_next = network.adjacency.sample(current, variates.uniform())
+                while node_next in visited:
+                    node_next = network.adjacency.sample(current, variates.uniform())
                 # Append a delay for this hop
-                delay_per_mix = exponential(self.mu)
+                delay_per_mix = variates.exponential(self.mu)
                 delays.append(delay_per_mix)
-                # Append the next node to the route
-                route.append(node_next)
-                route_ids.append(node_next.id)
-                current_node = node_next
-            print(f"[BA Debug] route so far: {route}")  
+                visited.append(node_next)
+                current = node_next
+            for index in visited:
+                node = network.mixes[index]
+                route.append(node)
+                route_ids.append(node.id)
+            if self.simulation.printing:
+                print(f"[BA Debug] route so far: {route}")
 
         elif self.simulation.topology == 'cyclic_stratified':
-            start_layer = random.randint(1, self.simulation.n_layers)
-            print(f"[Debug] Start Layer: {start_layer}")  
-            current_layer = start_layer
-            prev_node     = None 
-            for layer in range(self.simulation.n_layers):
-                # choose the mix for the *current* layer
-                if prev_node is None:                    # first hop
-                    node = np.random.choice(
-                        self.network_dict[current_layer],
-                        p=self.probability_dist_mixes[current_layer - 1]  # correct index
-                    )
-                else:                                   # subsequent hops
-                    node = np.random.choice(prev_node.neighbors)
+            # weighted mix of a uniformly chosen start layer, then its neighbors around the ring
+            mixes = self.routes.next()
+            if self.simulation.printing:
+                print(f"[Debug] Start Layer: {mixes[0].layer}")
+            for node in mixes:
                 # record hop‑delay and route entry
-                delay_per_mix = exponential(self.mu)
+                delay_per_mix = variates.exponential(self.mu)
                 delays.append(delay_per_mix)
                 route.append(node)
                 route_ids.append(node.id)
-                # prepare for next iteration
-                prev_node     = node
-                current_layer = (current_layer % self.simulation.n_layers) + 1
 
         else:
+            if self.simulation.topology == 'stratified':
+                mixes = self.routes.next()  # whole route for source routing, first mix for hop-by-hop
             for layer in range(1, self.simulation.n_layers+1):
-                delay_per_mix = exponential(self.mu)
+                delay_per_mix = variates.exponential(self.mu)
                 delays.append(delay_per_mix)
                 if self.simulation.routing == 'source' and self.simulation.topology == 'stratified'\
                         or (self.simulation.routing == 'hopbyhop' and self.simulation.topology == 'stratified' and layer == 1):
-                    if self.simulation.n_layers ==1 and self.simulation.n_mixes_per_layer == 1:
-                        node = self.network_dict[1][0]
-                        route.append(node)
-                        route_ids.append(node.id)
-                    else:
-                        if layer == 1:
-                            node = np.random.choice(self.network_dict[layer], p=self.probability_dist_mixes[layer - 1])
-                            route.append(node)
-                            route_ids.append(node.id)
-                        else:
-                            node = np.random.choice(node.neighbors)
-                            route.append(node)
-                            route_ids.append(node.id)
+                    node = mixes[layer - 1]
+                    route.append(node)
+                    route_ids.append(node.id)
                 # elif self.simulation.routing == 'source' and self.simulation.topology == 'free route'\
                 elif (self.simulation.routing == 'hopbyhop' and self.simulation.topology == 'free route' and layer == 1):
-                    node = choice(self.all_mixes)
-                    while node in route:
-                        node = choice(self.all_mixes)
+                    node = variates.choice(self.all_mixes)
                     route.append(node)
                     route_ids.append(node.id)
-                    print(f"==>> route: {route}")
+                    if self.simulation.printing:
+                        print(f"==>> route: {route}")
                 elif self.simulation.routing == 'hopbyhop' and layer != 1:
                     route.append(None)
                     route_ids.append(None)
                 elif self.simulation.routing == 'source' and self.simulation.topology == 'XRD':
-                    chain = random.choice(self.set_chains)
+                    chain = variates.choice(self.set_chains)
                     route = [self]
                     route_ids = [self.id]
                     for node in chain:
@@ -163,11 +155,12 @@ class Client:
         # batch algorithm
         receiver = self.current_batch_receiver
         # receiver = sample(list(self.other_clients), k=1)[0]
-        print(f"[Route Delays]: {delays}")
-        print(f"==>> Receiver: {receiver} at time {self.env.now}")
         route += [receiver]
         route_ids += [receiver.id]
-        print(f"[Debug] ==>> Route: {route}") 
+        if self.simulation.printing:
+            print(f"[Route Delays]: {delays}")
+            print(f"==>> Receiver: {receiver} at time {self.env.now}")
+            print(f"[Debug] ==>> Route: {route}")
 
         message = Message(self.message_id, message_type, self, route, delays, pr_target,False)
        
@@ -181,22 +174,13 @@ class Client:
         return message, delay_client
 
     def receive_message(self, message):
-        global next_outgoing_batch_id
         message.timeReceived = self.env.now
 
         # batch algorithm
         incoming_batch_id = message.incoming_batch_id
-
-        if incoming_batch_id not in incoming_outgoing_batch_map:
-            out_batch_id = next_outgoing_batch_id
-            next_outgoing_batch_id += 1
-            incoming_outgoing_batch_map[incoming_batch_id] = out_batch_id
+        out_batch_id, new_mapping = outgoing_batch_for(incoming_batch_id)
+        if new_mapping and self.simulation.printing:
             print(f"==>> Mapping IncBatch {incoming_batch_id} to OutBatch {out_batch_id}")
-            if out_batch_id not in outgoing_to_incoming_batch_map:
-                outgoing_to_incoming_batch_map[out_batch_id] = incoming_batch_id
-                print(f"==>> Mapping OutBatch {out_batch_id} to IncBatch {incoming_batch_id}")
-        else:
-            out_batch_id = incoming_outgoing_batch_map[incoming_batch_id]
         # print(f"==>> Inc to Out Batch Map: {incoming_outgoing_batch_map}")
 
         # Extract incoming msg number from msg id (format: M_batchid_msgno)
@@ -207,16 +191,21 @@ class Client:
         out_msg_id = f"O_{out_batch_id}_{incoming_msg_no}"
         message.outgoing_batch_id = out_batch_id
         message.outgoing_msg_id = out_msg_id
-        print(f'IncomingMsgID: {incoming_msg_id}\nOutgoingMsgID: {out_msg_id}')
+        if self.simulation.printing:
+            print(f'IncomingMsgID: {incoming_msg_id}\nOutgoingMsgID: {out_msg_id}')
 
         # Update global outgoing_batches dict
         if out_batch_id not in outgoing_batches:
-            outgoing_batches[out_batch_id] = {}
-        outgoing_batches[out_batch_id][out_msg_id] = message.timeReceived
-        print(f"==>> {out_msg_id} Received at : {message.timeReceived}")
+            self.simulation.outgoing_batch_opened()
+        # Constraints first, so a recorded trace replays them before the arrival they apply to
+        self.observe_corrupt_mixes(message, out_msg_id)
+        record_received(out_batch_id, out_msg_id, message.timeReceived)
+        if self.simulation.printing:
+            print(f"==>> {out_msg_id} Received at : {message.timeReceived}")
         # print(f"==>> Outgoing Batches: {outgoing_batches}")
         
         self.log.received_messages_f(message)
+        self.simulation.Metrics.add_target_probabilities(message.pr_target)
         if message.target_bool and self.simulation.printing:
             print(f'Target message arrived at destination Client at time {self.env.now}')
         if message.type == 'Real' or message.type == 'ClientDummy':
@@ -224,48 +213,67 @@ class Client:
         # Compute and print all possible permutations for each outgoing batch
         compute_batch_permutations(self, message)
 
-    def send_message(self, message_type, rate_client):
-        global next_incoming_batch_id
-        while True:
-            # batch-algorithm
-            # If not currently sending a batch, claim the next available batch id
-            if self.current_batch_id is None or self.sent_msg_count_in_batch >= self.batch_size:
-                self.current_batch_id = next_incoming_batch_id
-                next_incoming_batch_id += 1
-                self.sent_msg_count_in_batch = 0
-                self.current_batch_receiver = sample(list(self.other_clients), k=1)[0]
-                
-            batch_id = self.current_batch_id
-            msg_number = self.sent_msg_count_in_batch
-            msg_id = f"M_{batch_id}_{msg_number}"
-            
+    def observe_corrupt_mixes(self, message, out_msg_id):
+        # A corrupt mix reveals how messages cross it. If every mix on the route is corrupt the
+        # adversary links the outgoing message to its incoming one; with a corrupt tail it saw
+        # the message enter that tail (Mix.observe_arrival), so it was sent before then.
+        mixes = message.route[1:-1]
+        if not mixes or not any(mix.corrupt for mix in mixes):
+            return
+        if all(mix.corrupt for mix in mixes):
+            add_link_constraint(out_msg_id, in_msg_id=message.incoming_msg_id)
+            if self.simulation.printing:
+                print(f"==>> Corrupt route links {out_msg_id} to {message.incoming_msg_id}")
+        elif mixes[-1].corrupt:
+            entered = message.corrupt_tail_entered
+            add_link_constraint(out_msg_id, sent_before=entered)
+            if self.simulation.printing:
+                print(f"==>> Corrupt tail: {out_msg_id} was sent before {entered}")
 
-            message, delay = self.create_message(message_type, rate_client)
-            message.incoming_batch_id = batch_id
-            message.incoming_msg_id = msg_id
+    def send_message(self, message_type):
+        # Prepares the next message of message_type; message_left sends it after the client's
+        # delay and prepares the one after, so each message type keeps one message pending
+        # batch-algorithm
+        # If not currently sending a batch, claim the next available batch id
+        if self.current_batch_id is None or self.sent_msg_count_in_batch >= self.batch_size:
+            self.current_batch_id = claim_incoming_batch()
+            self.sent_msg_count_in_batch = 0
+            self.current_batch_receiver = self.variates.choice(self.other_clients)
 
-            yield self.env.timeout(delay)
-            print(f"==>> Incoming Msg id: {msg_id}")
-            print(f"==>> Sending Delay: {delay}")
-            message.time_left = self.env.now
+        batch_id = self.current_batch_id
+        msg_number = self.sent_msg_count_in_batch
+        msg_id = f"M_{batch_id}_{msg_number}"
 
-            # Track in global incoming_batches
-            if batch_id not in incoming_batches:
-                incoming_batches[batch_id] = {}
-            incoming_batches[batch_id][msg_id] = message.time_left
+        message, delay = self.create_message(message_type, self.send_rates[message_type])
+        message.incoming_batch_id = batch_id
+        message.incoming_msg_id = msg_id
+        self.simulation.call_later(delay, self.message_left, message)
+
+    def message_left(self, message):
+        message.time_left = self.env.now
+        batch_id = message.incoming_batch_id
+        msg_id = message.incoming_msg_id
+
+        # Track in global incoming_batches
+        record_sent(batch_id, msg_id, message.time_left)
+        if self.simulation.printing:
+            print(f"==>> Incoming Msg id: {msg_id}")
+            print(f"==>> Sending Delay: {message.delays[0]}")
             print(f"==>> {msg_id} Left at : {message.time_left}")
             print(f"==>> Incoming Batches: {incoming_batches}")
 
-            self.log.sent_messages_f(message)
-            self.env.process(self.simulation.attacker.relay(message, message.route[1]))
+        self.log.sent_messages_f(message)
+        self.simulation.attacker.relay(message, message.route[1])
+        if self.simulation.printing:
             print(f"==>> message.route[1]: {message.route}")
 
-            # Update per-client batch message count
-            self.sent_msg_count_in_batch += 1
+        # Update per-client batch message count
+        self.sent_msg_count_in_batch += 1
 
-            # If finished this batch, next loop will claim a new batch id
-            if self.sent_msg_count_in_batch >= self.batch_size:
-                self.current_batch_id = None
+        # If finished this batch, the next message claims a new batch id
+        if self.sent_msg_count_in_batch >= self.batch_size:
+            self.current_batch_id = None
+        self.send_message(message.type)
 
     def receive_ack(self, message):  # Message received
         pass
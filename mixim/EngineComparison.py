@@ -0,0 +1,126 @@
+import contextlib
+import io
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+import simpy
+from scipy import stats
+
+import BatchTracker
+
+# Compares Simulation(engine="fast") with the SimPy engine on the same configuration: events/sec
+# of both engines, and statistical tests of SimPy runs against fast runs of other seeds, which
+# show they sample the same model. That equal seeds give the very same run on both engines is
+# checked by test_engines.py. Runs are timed with printing and the matcher switched off, so
+# only the event simulation is measured.
+
+SIM_TIME = 60
+SEEDS = range(6)  # run on both engines
+OTHER_SEEDS = range(6, 12)  # fast engine only, for the statistical tests
+ALPHA = 0.01
+
+
+def run_once(engine, seed, config_file='ConfigFile.ini', until=SIM_TIME):
+    from main import create_simulation
+
+    BatchTracker.reset()
+    tracking = BatchTracker.tracking
+    BatchTracker.tracking = False
+    steps = [0]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            simulation = create_simulation(config_file, engine=engine, seed=seed)
+            simulation.printing = False
+            simulation.max_outgoing_batches = float('inf')  # run for the whole time span
+            if engine == "simpy":  # SimPy keeps no event count, so count this environment's steps
+                simpy_step = simulation.env.step
+
+                def counting_step():
+                    steps[0] += 1
+                    simpy_step()
+                simulation.env.step = counting_step
+            start = time.perf_counter()
+            entropy, entropy_mean, _, _ = simulation.run(until)
+            seconds = time.perf_counter() - start
+    finally:
+        BatchTracker.tracking = tracking
+
+    received = simulation.Log.received_messages
+    return {
+        "engine": engine,
+        "seed": seed,
+        "seconds": seconds,
+        "events": simulation.env.steps if engine == "fast" else steps[0],
+        "sent": len(simulation.Log.sent_messages),
+        "received": len(received),
+        "latencies": received["MessageTimeReceived"] - received["MessageTimeLeft"],
+        "entropy_mean": entropy_mean,
+    }
+
+
+def event_core(engine, n_chains=100, n_steps=2000, seed=0):
+    """
+    Events/sec of the bare engine on the model's hot path: chains of call_later callbacks
+    that each schedule the next after an exponential delay, as clients and mixes do.
+    """
+    from FastEnvironment import FastEnvironment, simpy_call_later
+
+    env = FastEnvironment() if engine == "fast" else simpy.Environment()
+    call_later = env.call_later if engine == "fast" else simpy_call_later(env)
+    delays = np.random.default_rng(seed).exponential(1.0, size=(n_chains, n_steps)).tolist()
+
+    def step(chain):
+        delays, i = chain
+        if i < len(delays):
+            call_later(delays[i], step, (delays, i + 1))
+
+    for chain_delays in delays:
+        call_later(0, step, (chain_delays, 0))
+    start = time.perf_counter()
+    env.run()
+    return n_chains * (n_steps + 1) / (time.perf_counter() - start)
+
+
+def compare(config_file='ConfigFile.ini', seeds=SEEDS, other_seeds=OTHER_SEEDS, until=SIM_TIME):
+    # Each run in its own process: the tracker and the random generators are module state
+    jobs = [(engine, seed, config_file, until) for engine in ("simpy", "fast") for seed in seeds]
+    jobs += [("fast", seed, config_file, until) for seed in other_seeds]
+    with Pool(maxtasksperchild=1) as pool:
+        runs = pool.starmap(run_once, jobs, chunksize=1)
+    by_engine = {engine: [run for run in runs if run["engine"] == engine and run["seed"] in seeds]
+                 for engine in ("simpy", "fast")}
+    other_runs = [run for run in runs if run["engine"] == "fast" and run["seed"] in other_seeds]
+
+    for engine, engine_runs in by_engine.items():
+        events = sum(run["events"] for run in engine_runs)
+        seconds = sum(run["seconds"] for run in engine_runs)
+        print(f"{engine}: {events} events in {seconds:.2f}s ({events / seconds:.0f} events/sec), "
+              f"{np.mean([run['received'] for run in engine_runs]):.1f} messages received per run")
+    speedup = sum(run["seconds"] for run in by_engine["simpy"]) / sum(run["seconds"] for run in by_engine["fast"])
+    print(f"Speedup: {speedup:.2f}x (whole model)")
+    core = {engine: max(event_core(engine) for _ in range(3)) for engine in ("simpy", "fast")}  # best of 3
+    print(f"Event core: simpy {core['simpy']:.0f} events/sec, fast {core['fast']:.0f} events/sec, "
+          f"speedup {core['fast'] / core['simpy']:.2f}x")
+
+    equivalent = True
+    simpy_runs = by_engine["simpy"]
+    checks = {
+        "end-to-end latency (KS)": stats.ks_2samp(np.concatenate([run["latencies"] for run in simpy_runs]),
+                                                  np.concatenate([run["latencies"] for run in other_runs])).pvalue,
+        "messages sent per run (t)": stats.ttest_ind([run["sent"] for run in simpy_runs],
+                                                     [run["sent"] for run in other_runs], equal_var=False).pvalue,
+        "messages received per run (t)": stats.ttest_ind([run["received"] for run in simpy_runs],
+                                                         [run["received"] for run in other_runs], equal_var=False).pvalue,
+    }
+    for name, pvalue in checks.items():
+        passed = not pvalue < ALPHA
+        equivalent = equivalent and passed
+        print(f"{name}, seeds {list(seeds)} vs {list(other_seeds)}: p={pvalue:.3f} {'ok' if passed else 'DIFFERENT'}")
+    return equivalent
+
+
+if __name__ == "__main__":
+    config_file = sys.argv[1] if len(sys.argv) > 1 else 'ConfigFile.ini'
+    sys.exit(0 if compare(config_file) else 1)
@@ -0,0 +1,153 @@
+import heapq
+from itertools import count
+
+# Same ordering as SimPy: (time, priority, insertion order); process starts and the stop
+# event of run(until=<time>) are urgent, everything else normal
+URGENT = 0
+NORMAL = 1
+
+
+class StopSimulation(Exception):
+    pass
+
+
+class Event:
+    __slots__ = ('env', 'callbacks', 'value', 'triggered')
+
+    def __init__(self, env):
+        self.env = env
+        self.callbacks = []  # None once the event has been processed
+        self.value = None
+        self.triggered = False
+
+    @property
+    def processed(self):
+        return self.callbacks is None
+
+    def succeed(self, value=None):
+        if self.triggered:
+            raise RuntimeError(f'{self} has already been triggered')
+        self.value = value
+        self.env.schedule(self)
+        return self
+
+
+class Timeout(Event):
+    __slots__ = ()
+
+    def __init__(self, env, delay, value=None):
+        if delay < 0:
+            raise ValueError(f'Negative delay {delay}')
+        self.env = env
+        self.callbacks = []
+        self.value = value
+        self.triggered = True
+        heapq.heappush(env.queue, (env.now + delay, NORMAL, next(env.eid), env.fire, self))
+
+
+class Process(Event):
+    """Runs a generator that yields events; it resumes when the yielded event is processed."""
+    __slots__ = ('generator',)
+
+    def __init__(self, env, generator):
+        super().__init__(env)
+        self.generator = generator
+        start = Event(env)
+        start.callbacks.append(self.resume)
+        env.schedule(start, URGENT)
+
+    def resume(self, event):
+        send = self.generator.send
+        while True:
+            try:
+                event = send(event.value)
+            except StopIteration as stop:
+                self.succeed(stop.value)
+                return
+            if event.callbacks is not None:
+                event.callbacks.append(self.resume)
+                return
+            # already processed: continue right away, as SimPy does
+
+
+class FastEnvironment:
+    """
+    Minimal discrete-event core on heapq for the simulation. Every queue entry is a plain
+    (time, priority, order, callback, value) tuple: call_later schedules callback(value)
+    without creating any event object, which is how the model's per-message work (sending,
+    relaying, mix departures and flushes) is scheduled. Events, timeouts and generator
+    processes are kept for the rest of the model and for run(until=<event>).
+    """
+
+    def __init__(self, initial_time=0.0):
+        self.now = initial_time
+        self.queue = []
+        self.eid = count()
+        self.steps = 0  # entries processed, for benchmarking
+
+    def call_later(self, delay, callback, value=None):
+        """Runs callback(value) delay time units from now."""
+        heapq.heappush(self.queue, (self.now + delay, NORMAL, next(self.eid), callback, value))
+
+    def schedule(self, event, priority=NORMAL, delay=0):
+        event.triggered = True
+        heapq.heappush(self.queue, (self.now + delay, priority, next(self.eid), self.fire, event))
+
+    @staticmethod
+    def fire(event):
+        callbacks, event.callbacks = event.callbacks, None
+        for callback in callbacks:
+            callback(event)
+
+    def timeout(self, delay, value=None):
+        return Timeout(self, delay, value)
+
+    def event(self):
+        return Event(self)
+
+    def process(self, generator):
+        return Process(self, generator)
+
+    def step(self):
+        self.now, _, _, callback, value = heapq.heappop(self.queue)
+        self.steps += 1
+        callback(value)
+
+    def run(self, until=None):
+        if until is not None:
+            if not isinstance(until, Event):
+                at = float(until)
+                if at <= self.now:
+                    raise ValueError(f'until ({at}) must be greater than the current time ({self.now})')
+                until = Event(self)
+                until.triggered = True
+                heapq.heappush(self.queue, (at, URGENT, next(self.eid), self.fire, until))
+            elif until.processed:
+                return until.value
+            until.callbacks.append(self.stop)
+        queue = self.queue
+        pop = heapq.heappop
+        steps = 0
+        try:
+            while queue:
+                # step() inlined, this loop is the hot path
+                self.now, _, _, callback, value = pop(queue)
+                steps += 1
+                callback(value)
+        except StopSimulation:
+            return until.value
+        finally:
+            self.steps += steps
+        if until is not None:
+            raise RuntimeError(f'No scheduled events left but "until" event was not triggered: {until}')
+
+    @staticmethod
+    def stop(event):
+        raise StopSimulation()
+
+
+def simpy_call_later(env):
+    """call_later for a simpy.Environment: a timeout whose callback passes its value on."""
+    def call_later(delay, callback, value=None):
+        env.timeout(delay, value).callbacks.append(lambda event: callback(event.value))
+    return call_later
@@ -1,30 +1,88 @@
+import numpy as np
+import pandas as pd
+
+from util import GrowableArray, RaggedArray
+
+MESSAGE_TYPES = ["Real", "Dummy", "ClientDummy"]
+MESSAGE_TYPE_CODES = {name: code for code, name in enumerate(MESSAGE_TYPES)}
+NO_NODE = -1  # route slot not chosen yet (hop-by-hop routing)
+
+
+class MessageTable:
+    """
+    Columnar table of logged messages: scalar fields in growable NumPy arrays, per-message
+    lists (delays, route, the nonzero pr_target entries) as ragged arrays. Messages are identified by
+    (sender id, sequence number); routes hold node ids, where the first and last entries are
+    clients and the ones in between mixes.
+    """
+
+    def __init__(self, scalars, ragged):
+        self.columns = {name: GrowableArray(dtype) for name, dtype in scalars.items()}
+        self.ragged = {name: RaggedArray(dtype) for name, dtype in ragged.items()}
+
+    def __len__(self):
+        return len(next(iter(self.columns.values())))
+
+    def __getitem__(self, name):
+        return self.columns[name].view() if name in self.columns else self.ragged[name].rows()
+
+    def append(self, scalars, ragged):
+        for name, value in scalars.items():
+            self.columns[name].append(value)
+        for name, row in ragged.items():
+            self.ragged[name].append(row)
+
+    def arrays(self):
+        arrays = {name: column.view() for name, column in self.columns.items()}
+        for name, column in self.ragged.items():
+            arrays[f"{name}_offsets"], arrays[name] = column.view()
+        return arrays
+
+    def to_frame(self):
+        data = {name: column.view() for name, column in self.columns.items()}
+        data.update({name: column.rows() for name, column in self.ragged.items()})
+        return pd.DataFrame(data, copy=False)
+
+
+def route_ids(route):
+    return [NO_NODE if node is None else node.id for node in route]
+
 
 class Log:
     def __init__(self):
-        self.sent_messages = {"MessageID": [], "MessageType": [], "MessageTimeLeft" :[], "MessageDelay": [], "MessageRoute" :[]}
-        self.received_messages = {"MessageID": [], "MessageType": [], "MessageTimeLeft" :[],"MessageTimeReceived":[], "MessageDelay": [], "MessageRoute" :[],"MessageTarget" : [] }
-        self.dummy_messages = {"DroppingNode":[],"DummyID": [], "DummyType": [], "DummyTimeLeft" :[], "DummyDelay": [], "DummyRoute" :[], "DummyPr":[]}
+        self.sent_messages = MessageTable(
+            {"MessageSender": np.int32, "MessageSeq": np.int64, "MessageType": np.int8, "MessageTimeLeft": np.float64},
+            {"MessageDelay": np.float64, "MessageRoute": np.int32})
+        self.received_messages = MessageTable(
+            {"MessageSender": np.int32, "MessageSeq": np.int64, "MessageType": np.int8, "MessageTimeLeft": np.float64,
+             "MessageTimeReceived": np.float64},
+            {"MessageDelay": np.float64, "MessageRoute": np.int32})
+        self.dummy_messages = MessageTable(
+            {"DroppingNode": np.int32, "DummySender": np.int32, "DummySeq": np.int64, "DummyType": np.int8,
+             "DummyTimeLeft": np.float64},
+            {"DummyDelay": np.float64, "DummyRoute": np.int32, "DummyPrTarget": np.int32, "DummyPr": np.float64})
+
     def dummies_dropped_end_link(self, dummy, dropping_node):
-        self.dummy_messages["DroppingNode"].append(dropping_node)
-        self.dummy_messages["DummyID"].append(dummy.id)
-        self.dummy_messages["DummyType"].append(dummy.type)
-        self.dummy_messages["DummyTimeLeft"].append(dummy.time_left)
-        self.dummy_messages["DummyDelay"].append(dummy.delays)
-        self.dummy_messages["DummyRoute"].append(dummy.route)
-        self.dummy_messages["DummyPr"].append(dummy.pr_target)
+        self.dummy_messages.append(
+            {"DroppingNode": dropping_node, "DummySender": dummy.sender.id, "DummySeq": dummy.seq,
+             "DummyType": MESSAGE_TYPE_CODES[dummy.type], "DummyTimeLeft": dummy.time_left},
+            {"DummyDelay": dummy.delays, "DummyRoute": route_ids(dummy.route), "DummyPrTarget": dummy.pr_target[0],
+             "DummyPr": dummy.pr_target[1]})
 
     def sent_messages_f(self, msg):
-        self.sent_messages["MessageID"].append(msg.id)
-        self.sent_messages["MessageType"].append(msg.type)
-        self.sent_messages["MessageTimeLeft"].append(msg.time_left)
-        self.sent_messages["MessageDelay"].append(msg.delays)
-        self.sent_messages["MessageRoute"].append(msg.route)
+        self.sent_messages.append(
+            {"MessageSender": msg.sender.id, "MessageSeq": msg.seq, "MessageType": MESSAGE_TYPE_CODES[msg.type],
+             "MessageTimeLeft": msg.time_left},
+            {"MessageDelay": msg.delays, "MessageRoute": route_ids(msg.route)})
 
     def received_messages_f(self, msg):
-        self.received_messages["MessageID"].append(msg.id)
-        self.received_messages["MessageType"].append(msg.type)
-        self.received_messages["MessageTimeLeft"].append(msg.time_left)
-        self.received_messages["MessageTimeReceived"].append(msg.timeReceived)
-        self.received_messages["MessageDelay"].append(msg.delays)
-        self.received_messages["MessageRoute"].append(msg.route)
-        self.received_messages["MessageTarget"].append(msg.pr_target)
\ No newline at end of file
+        self.received_messages.append(
+            {"MessageSender": msg.sender.id, "MessageSeq": msg.seq, "MessageType": MESSAGE_TYPE_CODES[msg.type],
+             "MessageTimeLeft": msg.time_left, "MessageTimeReceived": msg.timeReceived},
+            {"MessageDelay": msg.delays, "MessageRoute": route_ids(msg.route)})
+
+    def save(self, logDir="Logs/", suffix=""):
+        # One .npz per table; ragged columns come with their <name>_offsets array
+        np.savez(f"{logDir}SentMessages{suffix}.npz", **self.sent_messages.arrays())
+        np.savez(f"{logDir}ReceivedMessages{suffix}.npz", **self.received_messages.arrays())
+        np.savez(f"{logDir}DummyMessages{suffix}.npz", **self.dummy_messages.arrays())
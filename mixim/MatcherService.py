@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import BatchTracker
+from Observation import EventDecoder, ObservationReplay, encode_binary, encode_ndjson
+from TraceGenerator import generate_trace
+
+CHUNK_SIZE = 64 * 1024
+MAX_EVENTS_PER_STEP = 256  # events handed to the matcher thread at once
+
+
+class MatcherService:
+    """
+    Runs the batch matcher as an asyncio service over a stream of observation events
+    (newline-delimited JSON or binary records, see Observation.py).
+
+    Ingestion only parses and queues events; the bounded queue applies backpressure to the
+    sender when the matcher falls behind. All tracker work (feeding events and taking
+    batch_prob snapshots) runs on one worker thread so the tracker globals are never
+    touched concurrently and the event loop keeps reading while the matcher computes.
+    """
+
+    def __init__(self, replay=None, queue_size=10000, snapshot_interval=1.0, binary=False):
+        self.replay = replay if replay is not None else ObservationReplay(log_suffix="_service")
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.snapshot_interval = snapshot_interval  # wall-clock seconds between snapshots
+        self.binary = binary
+        self.snapshots = []
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.started = None
+
+    async def ingest(self, reader):
+        decoder = EventDecoder(self.binary)
+        while True:
+            chunk = await reader.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            for event in decoder.feed(chunk):
+                await self.queue.put(event)
+
+    async def ingest_file(self, path):
+        loop = asyncio.get_running_loop()
+        decoder = EventDecoder(self.binary)
+        with open(path, "rb") as f:
+            while True:
+                chunk = await loop.run_in_executor(None, f.read, CHUNK_SIZE)
+                if not chunk:
+                    break
+                for event in decoder.feed(chunk):
+                    await self.queue.put(event)
+
+    async def match(self):
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            events = [await self.queue.get()]
+            while len(events) < MAX_EVENTS_PER_STEP and not self.queue.empty():
+                events.append(self.queue.get_nowait())
+            if None in events:  # end of input
+                events = events[:events.index(None)]
+                done = True
+            await loop.run_in_executor(self.executor, self.replay.feed_many, events)
+
+    async def take_snapshots(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            await self.snapshot()
+
+    async def snapshot(self):
+        loop = asyncio.get_running_loop()
+        snapshot = await loop.run_in_executor(self.executor, self.replay.snapshot)
+        snapshot["events_per_sec"] = self.throughput()
+        self.snapshots.append(snapshot)
+        print(f"[MatcherService] t={snapshot['time']:.3f} events={snapshot['events']} "
+              f"out_batches={len(snapshot['batch_prob'])} queued={self.queue.qsize()} "
+              f"events/sec={snapshot['events_per_sec']:.1f}")
+        return snapshot
+
+    def throughput(self):
+        elapsed = time.perf_counter() - self.started if self.started else 0
+        return self.replay.events / elapsed if elapsed > 0 else 0.0
+
+    async def run(self, ingestion):
+        """Matches everything the ingestion coroutine queues, returns events/sec once it is drained."""
+        self.started = time.perf_counter()
+        matcher = asyncio.create_task(self.match())
+        snapshots = asyncio.create_task(self.take_snapshots())
+        try:
+            await ingestion
+            await self.queue.put(None)
+            await matcher
+        finally:
+            snapshots.cancel()
+        await self.snapshot()
+        self.replay.Metrics.close(self.replay.logDir, self.replay.log_suffix)
+        return self.throughput()
+
+    async def run_file(self, path):
+        return await self.run(self.ingest_file(path))
+
+    async def run_unix(self, path, connections=1):
+        """Listens on a unix socket and matches the events of the next `connections` clients."""
+        closed = asyncio.Queue()
+
+        async def handle(reader, writer):
+            try:
+                await self.ingest(reader)
+            finally:
+                writer.close()
+                await closed.put(True)
+
+        async def ingestion():
+            server = await asyncio.start_unix_server(handle, path)
+            async with server:
+                for _ in range(connections):
+                    await closed.get()
+
+        return await self.run(ingestion())
+
+
+def generate_events(n_clients=4, batch_size=2, n_batches=2, lambda_c=1.0, mu=1.0, n_hops=1, seed=None):
+    """
+    Local stand-in for a testbed: each client sends n_batches batches of batch_size messages,
+    drawn in closed form by TraceGenerator.
+    """
+    return generate_trace(n_clients, batch_size, lambda_c, mu, n_hops, n_batches=n_batches, seed=seed).tolist()
+
+
+async def replay_events(path, events, binary=False):
+    """Writes events to the service's unix socket, as a testbed tap would."""
+    _, writer = await asyncio.open_unix_connection(path)
+    encode = encode_binary if binary else encode_ndjson
+    for event in events:
+        writer.write(encode(event))
+        await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+
+
+async def demo(binary=False):
+    service = MatcherService(snapshot_interval=0.5, binary=binary)
+    events = generate_events(seed=1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "matcher.sock")
+        serving = asyncio.create_task(service.run_unix(path))
+        while not os.path.exists(path):
+            await asyncio.sleep(0.01)
+        await replay_events(path, events, binary)
+        return await serving
+
+
+if __name__ == "__main__":
+    BatchTracker.logger.setLevel(logging.WARNING)
+    if len(sys.argv) > 1:  # replay a capture: *.bin files hold binary records, anything else NDJSON
+        service = MatcherService(binary=sys.argv[1].endswith(".bin"))
+        events_per_sec = asyncio.run(service.run_file(sys.argv[1]))
+    else:
+        events_per_sec = asyncio.run(demo())
+    print(f"Throughput: {events_per_sec:.1f} events/sec")
@@ -1,11 +1,21 @@
+import numpy as np
+
+# pr_target is a pair of arrays: the target indices with nonzero probability and those probabilities
+NO_TARGETS = (np.empty(0, dtype=np.int64), np.empty(0))
+
+
 class Message:
+    __slots__ = ("seq", "type", "sender", "route", "delays", "pr_target", "target_bool", "time_left", "next_hop_index",
+                 "incoming_batch_id", "incoming_msg_id", "outgoing_batch_id", "outgoing_msg_id", "timeReceived", "creator",
+                 "corrupt_tail_entered")
+
     def __init__(self, id, type, sender, route, delays, pr_target, target_bool, incoming_batch_id=None, incoming_msg_id=None, outgoing_batch_id=None, outgoing_msg_id=None):
        
-        self.id = "%d_%d" % (sender.id, id)
+        self.seq = id  # sequence number at the sender
         self.type = type  # Dummy or Real packet
         self.sender = sender  # sender object
-        self.route = route  # e.g. [S1, mix1, mix2, mix3, R5]
-        self.delays = delays  # list of delays at 3 nodes
+        self.route = route  # e.g. [S1, mix1, mix2, mix3, R5]; a list, hop-by-hop routing fills in slots on the way
+        self.delays = tuple(delays)  # delays at each node of the route
         self.pr_target = pr_target  # probability of this message being the target message
         self.target_bool = target_bool  # True if this message is a target message
         self.time_left = 0
@@ -14,5 +24,11 @@ class Message:
         self.incoming_msg_id = incoming_msg_id
         self.outgoing_batch_id = outgoing_batch_id
         self.outgoing_msg_id = outgoing_msg_id
+        self.corrupt_tail_entered = None  # arrival at the first of the corrupt mixes it crossed last
 
-      
\ No newline at end of file
+    @property
+    def id(self):
+        # Only formatted when asked for (printing); the log keeps (sender, seq) as integers
+        if self.type == 'Dummy':
+            return f'd_{self.sender.id}_{self.seq}'
+        return "%d_%d" % (self.sender.id, self.seq)
@@ -1,11 +1,131 @@
+import os
+import queue
+import threading
+from functools import partial
+
+import numpy as np
 import pandas as pd
 
+from util import GrowableArray
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+BATCH_LOG_COLUMNS = ["window_index", "out_batch_id", "true_in_batch_id", "correct_batch_prob", "correct_batch_is_highest",
+                     "anonymity_set_size", "anonymity_set", "n_clients", "batch_size", "batch_prob",
+                     "sim_timestamp", "utc_timestamp"]
+MAP_LOG_COLUMNS = ["window_index", "out_batch_id", "true_in_batch_id", "map_in_batch_id", "map_is_correct",
+                   "map_log_likelihood", "joint_correct", "n_clients", "batch_size", "sim_timestamp", "utc_timestamp"]
+# Columns holding sets/dicts are written as their repr, the same text the CSV files always had
+TEXT_COLUMNS = {"anonymity_set", "batch_prob", "delta_op"}
+INT_COLUMNS = {"window_index", "out_batch_id", "true_in_batch_id", "map_in_batch_id", "anonymity_set_size",
+               "n_clients", "batch_size", "utc_timestamp"}
+BOOL_COLUMNS = {"correct_batch_is_highest", "map_is_correct", "joint_correct"}
+DELTA_OPS = [None, "set", "del", "tick"]
+DELTA_OP_CODES = {op: code for code, op in enumerate(DELTA_OPS)}
+
+
+class BatchLogBuffer:
+    """
+    Columnar store for the batch logs. Numeric fields live in growable NumPy arrays (None is
+    kept as a mask), batch_prob and anonymity_set as offsets into flat key/value arrays.
+    Rows are never changed once appended, so views of the filled part stay valid while it grows.
+    """
+    NUMERIC = {"window_index": np.int64, "out_batch_id": np.int64, "true_in_batch_id": np.int64,
+               "correct_batch_prob": np.float64, "correct_batch_is_highest": np.bool_,
+               "anonymity_set_size": np.int64, "n_clients": np.int64, "batch_size": np.int64,
+               "sim_timestamp": np.float64, "utc_timestamp": np.int64}
+
+    def __init__(self, capacity=1024):
+        self.columns = {name: GrowableArray(dtype, capacity) for name, dtype in self.NUMERIC.items()}
+        self.missing = {name: GrowableArray(np.bool_, capacity) for name in self.NUMERIC}
+        self.delta_op = GrowableArray(np.int8, capacity)
+        self.prob_offsets = GrowableArray(np.int64, capacity + 1)
+        self.prob_offsets.append(0)
+        self.prob_in_batch = GrowableArray(np.int64, 4 * capacity)
+        self.prob_value = GrowableArray(np.float64, 4 * capacity)
+        self.set_offsets = GrowableArray(np.int64, capacity + 1)
+        self.set_offsets.append(0)
+        self.set_members = GrowableArray(np.int64, 4 * capacity)
+        self.has_delta_op = False
+
+    def __len__(self):
+        return len(self.delta_op)
+
+    def append(self, values, anonymity_set, batch_prob, delta_op=None):
+        for name, column in self.columns.items():
+            value = values.get(name)
+            self.missing[name].append(value is None)
+            column.append(0 if value is None else value)
+        self.delta_op.append(DELTA_OP_CODES[delta_op])
+        self.has_delta_op = self.has_delta_op or delta_op is not None
+        self.prob_in_batch.extend(list(batch_prob.keys()))
+        self.prob_value.extend(list(batch_prob.values()))
+        self.prob_offsets.append(len(self.prob_in_batch))
+        self.set_members.extend(list(anonymity_set))
+        self.set_offsets.append(len(self.set_members))
+
+    def batch_prob(self, start=0, stop=None):
+        """Offsets (rebased to start at 0), in-batch ids and probabilities of rows start:stop, as views."""
+        stop = len(self) if stop is None else stop
+        offsets = self.prob_offsets.view(start, stop + 1)
+        return (offsets - offsets[0], self.prob_in_batch.view(offsets[0], offsets[-1]),
+                self.prob_value.view(offsets[0], offsets[-1]))
+
+    def anonymity_set(self, start=0, stop=None):
+        stop = len(self) if stop is None else stop
+        offsets = self.set_offsets.view(start, stop + 1)
+        return offsets - offsets[0], self.set_members.view(offsets[0], offsets[-1])
+
+    def to_frame(self, start=0, stop=None):
+        """
+        DataFrame of rows start:stop. Numeric columns wrap the buffers without copying (as
+        nullable pandas arrays where a value was None); batch_prob and anonymity_set are
+        rendered as the dict/set text the CSV logs have always held.
+        """
+        stop = len(self) if stop is None else stop
+        data = {}
+        for name in BATCH_LOG_COLUMNS:
+            if name == "batch_prob":
+                offsets, keys, probs = self.batch_prob(start, stop)
+                keys, probs = keys.tolist(), probs.tolist()
+                data[name] = [str(dict(zip(keys[a:b], probs[a:b]))) for a, b in zip(offsets[:-1], offsets[1:])]
+            elif name == "anonymity_set":
+                offsets, members = self.anonymity_set(start, stop)
+                members = members.tolist()
+                data[name] = [str(set(members[a:b])) for a, b in zip(offsets[:-1], offsets[1:])]
+            else:
+                data[name] = self.column(name, start, stop)
+        if self.has_delta_op:
+            data["delta_op"] = np.array(DELTA_OPS, dtype=object)[self.delta_op.view(start, stop)]
+        return pd.DataFrame(data, copy=False)
+
+    def column(self, name, start=0, stop=None):
+        values = self.columns[name].view(start, stop)
+        missing = self.missing[name].view(start, stop)
+        if not missing.any():
+            return values
+        if values.dtype == np.bool_:
+            return pd.arrays.BooleanArray(values, missing)
+        if values.dtype == np.float64:
+            return np.where(missing, np.nan, values)
+        return pd.arrays.IntegerArray(values, missing)
+
 
 class Metrics:
-    def __init__(self):
-        self.batch_logs = []
+    def __init__(self, log_format="csv"):
+        self.batch_logs = BatchLogBuffer()
+        self.map_logs = []
+        # Parquet needs pyarrow; without it the periodic logs stay CSV
+        self.log_format = "parquet" if log_format == "parquet" and pa is not None else "csv"
+        self.writer = None
+        self.flushed = {"batch_logs": 0, "map_logs": 0}
+        self.target_entropy = None  # running sum of -p*log2(p) per target over received messages
 
-    def add_batch_log(self, out_batch_id, true_in_batch_id, anonymity_set_size, anonymity_set, batch_prob, sim_timestamp=None, utc_timestamp=None, window_index=None, n_clients=None, batch_size=None):
+    def add_batch_log(self, out_batch_id, true_in_batch_id, anonymity_set_size, anonymity_set, batch_prob, sim_timestamp=None, utc_timestamp=None, window_index=None, n_clients=None, batch_size=None, delta_op=None):
         log_entry = {
             "window_index": window_index,
             "out_batch_id": out_batch_id,
@@ -13,15 +133,181 @@ class Metrics:
             "correct_batch_prob": batch_prob.get(true_in_batch_id, None),
             "correct_batch_is_highest": batch_prob.get(true_in_batch_id, 0) == max(batch_prob.values()) if batch_prob else None,
             "anonymity_set_size": anonymity_set_size,
-            "anonymity_set": anonymity_set,
             "n_clients": n_clients,
             "batch_size": batch_size,
-            "batch_prob": batch_prob,
             "sim_timestamp": sim_timestamp,
             "utc_timestamp": utc_timestamp,
         }
-        self.batch_logs.append(log_entry)
+        self.batch_logs.append(log_entry, anonymity_set, batch_prob, delta_op)
+
+    def track_targets(self, n_targets):
+        self.target_entropy = np.zeros(n_targets)
+
+    def add_target_probabilities(self, pr_target):
+        # pr_target holds only the nonzero probabilities: (target indices, probabilities)
+        targets, probabilities = pr_target
+        self.target_entropy[targets] -= probabilities * np.log2(probabilities)
+
+    def entropy(self, n_targets):
+        return self.target_entropy if self.target_entropy is not None else np.zeros(n_targets)
+
+    def add_map_log(self, out_batch_id, true_in_batch_id, map_in_batch_id, map_log_likelihood, joint_correct, sim_timestamp=None, utc_timestamp=None, window_index=None, n_clients=None, batch_size=None):
+        log_entry = {
+            "window_index": window_index,
+            "out_batch_id": out_batch_id,
+            "true_in_batch_id": true_in_batch_id,
+            "map_in_batch_id": map_in_batch_id,
+            "map_is_correct": map_in_batch_id is not None and map_in_batch_id == true_in_batch_id,
+            "map_log_likelihood": map_log_likelihood,
+            "joint_correct": joint_correct,
+            "n_clients": n_clients,
+            "batch_size": batch_size,
+            "sim_timestamp": sim_timestamp,
+            "utc_timestamp": utc_timestamp,
+        }
+        self.map_logs.append(log_entry)
+
+    def flush(self, logDir="Logs/", filename_suffix=""):
+        """
+        Hands the rows logged since the last flush to the background writer, which appends them
+        to one file per run (logDir/batch_logs{suffix}.csv or .parquet). Never waits on disk.
+        """
+        if self.writer is None:
+            self.writer = LogWriter(logDir, filename_suffix, self.log_format)
+        # Batch log rows are rendered by the writer thread, which only reads the (unchanging)
+        # rows up to the flush point
+        rows = len(self.batch_logs)
+        if rows > self.flushed["batch_logs"]:
+            self.writer.append("batch_logs", partial(self.batch_logs.to_frame, self.flushed["batch_logs"], rows))
+            self.flushed["batch_logs"] = rows
+        if len(self.map_logs) > self.flushed["map_logs"]:
+            self.writer.append("map_logs", self.map_logs[self.flushed["map_logs"]:])
+            self.flushed["map_logs"] = len(self.map_logs)
+
+    def close(self, logDir="Logs/", filename_suffix=""):
+        # Flushes what is left and waits for the writer; the file location is the one of the first flush
+        self.flush(logDir, filename_suffix)
+        self.writer.close()
+        self.writer = None
 
     def save(self, logDir="Logs/", filename_suffix=""):
+        # One-shot dump of everything logged so far, for runs that do not stream their logs
         filename = f"{logDir}batch_logs{filename_suffix}.csv"
-        pd.DataFrame(self.batch_logs).to_csv(filename, index=False)
\ No newline at end of file
+        self.batch_logs.to_frame().to_csv(filename, index=False)
+        if self.map_logs:
+            pd.DataFrame(self.map_logs).to_csv(f"{logDir}map_logs{filename_suffix}.csv", index=False)
+
+
+class LogWriter(threading.Thread):
+    """Appends chunks of log rows to their files from a background thread."""
+
+    def __init__(self, logDir, filename_suffix, log_format="csv"):
+        super().__init__(daemon=True)
+        self.paths = {name: f"{logDir}{name}{filename_suffix}.{log_format}" for name in ("batch_logs", "map_logs")}
+        self.log_format = log_format
+        self.columns = {}
+        self.parquet_writers = {}
+        self.chunks = queue.Queue()  # unbounded, so append never blocks the simulation
+        self.error = None
+        self.start()
+
+    def append(self, name, rows):
+        self.chunks.put((name, rows))
+
+    def close(self):
+        self.chunks.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        try:
+            while True:
+                chunk = self.chunks.get()
+                if chunk is None:
+                    break
+                self.write(*chunk)
+        except Exception as e:
+            self.error = e
+        finally:
+            for writer in self.parquet_writers.values():
+                writer.close()
+
+    def write(self, name, rows):
+        # rows is a list of dicts or a callable building the chunk's DataFrame
+        if callable(rows):
+            rows = rows()
+        if name not in self.columns:
+            # The column list is fixed by the first chunk, so every later chunk lines up with the header
+            known = BATCH_LOG_COLUMNS if name == "batch_logs" else MAP_LOG_COLUMNS
+            first = rows.columns if isinstance(rows, pd.DataFrame) else rows[0]
+            self.columns[name] = known + [column for column in first if column not in known]
+            if os.path.exists(self.paths[name]):
+                os.remove(self.paths[name])
+        columns = self.columns[name]
+        if self.log_format == "parquet":
+            self.write_parquet(name, rows, columns)
+            return
+        df = rows.reindex(columns=columns) if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows, columns=columns)
+        df.to_csv(self.paths[name], mode="a", index=False, header=not os.path.exists(self.paths[name]))
+
+    def write_parquet(self, name, rows, columns):
+        # Each chunk becomes one row group
+        if name not in self.parquet_writers:
+            schema = pa.schema([(column, pa.string() if column in TEXT_COLUMNS else
+                                 pa.int64() if column in INT_COLUMNS else
+                                 pa.bool_() if column in BOOL_COLUMNS else pa.float64())
+                                for column in columns])
+            self.parquet_writers[name] = pq.ParquetWriter(self.paths[name], schema)
+        writer = self.parquet_writers[name]
+        if isinstance(rows, pd.DataFrame):
+            writer.write_table(pa.Table.from_pandas(rows.reindex(columns=columns), schema=writer.schema, preserve_index=False))
+            return
+        data = [{column: (str(row.get(column)) if column in TEXT_COLUMNS and row.get(column) is not None
+                          else row.get(column)) for column in columns} for row in rows]
+        writer.write_table(pa.Table.from_pylist(data, schema=writer.schema))
+
+
+def read_batch_logs(path):
+    """
+    Reads a batch log CSV. Delta-encoded logs (with a delta_op column) are expanded back into
+    one row per outgoing batch per window, the layout the analysis scripts expect.
+    """
+    df = pd.read_parquet(path) if str(path).endswith(".parquet") else pd.read_csv(path)
+    if "delta_op" not in df.columns:
+        return df
+    return expand_delta_logs(df)
+
+
+def expand_delta_logs(df):
+    # Every window shares one timestamp; take it from whichever rows the window has
+    window_times = df.groupby("window_index")[["sim_timestamp", "utc_timestamp"]].first()
+    last_window = df["window_index"].max()
+
+    # A "set" row holds until the next row ("set" or "del") of the same outgoing batch
+    changes = df[df["delta_op"] != "tick"].sort_values(["out_batch_id", "window_index"], kind="stable")
+    next_window = changes.groupby("out_batch_id")["window_index"].shift(-1).fillna(last_window + 1)
+    held = (changes["delta_op"] == "set").to_numpy()
+    rows = changes[held].reset_index(drop=True)
+    starts = rows["window_index"].to_numpy(dtype=np.int64)
+    counts = next_window.to_numpy(dtype=np.int64)[held] - starts
+
+    expanded = rows.loc[np.repeat(rows.index.to_numpy(), counts)].reset_index(drop=True)
+    offsets = np.arange(len(expanded)) - np.repeat(np.cumsum(counts) - counts, counts)
+    expanded["window_index"] = np.repeat(starts, counts) + offsets
+    # Carried-over rows take the timestamps of the window they are repeated into
+    expanded["sim_timestamp"] = window_times["sim_timestamp"].reindex(expanded["window_index"]).to_numpy()
+    expanded["utc_timestamp"] = window_times["utc_timestamp"].reindex(expanded["window_index"]).to_numpy()
+    expanded = expanded[expanded["window_index"].isin(window_times.index)].copy()
+    # The "tick" and "del" rows left NaN in some columns, so pandas read them as float/object;
+    # give them back the dtypes of a full log (nullable ones only where a value is really missing)
+    for column in expanded.columns:
+        if column in INT_COLUMNS or column in BOOL_COLUMNS:
+            missing = expanded[column].isna().any()
+            if column in INT_COLUMNS:
+                expanded[column] = expanded[column].astype("Int64" if missing else np.int64)
+            else:
+                expanded[column] = expanded[column].astype("boolean" if missing else np.bool_)
+    return (expanded.drop(columns="delta_op")
+            .sort_values(["window_index", "out_batch_id"], kind="stable")
+            .reset_index(drop=True))
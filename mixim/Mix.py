@@ -1,11 +1,45 @@
 from Client import Client
-from numpy.random import exponential
-from Message import Message
-from random import choice, sample
+from Message import Message, NO_TARGETS
 import numpy as np
+from util import VariateBuffer
 
 
 
+class IndexedPool:
+    """Pool of messages with O(1) append and removal (the last message takes the removed one's slot)."""
+
+    def __init__(self, variates):
+        self.messages = []
+        self.index = {}
+        self.variates = variates
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def append(self, msg):
+        self.index[msg] = len(self.messages)
+        self.messages.append(msg)
+
+    def remove(self, msg):
+        i = self.index.pop(msg)
+        last = self.messages.pop()
+        if last is not msg:
+            self.messages[i] = last
+            self.index[last] = i
+
+    def sample_remove(self, k):
+        """Removes and returns k messages chosen uniformly at random, in O(k)."""
+        chosen = []
+        for _ in range(min(k, len(self.messages))):
+            msg = self.variates.choice(self.messages)
+            self.remove(msg)
+            chosen.append(msg)
+        return chosen
+
+
 class Mix:
     def __init__(self, id, simulation, position, n_targets, corrupt):
         # logging
@@ -15,10 +49,9 @@ class Mix:
         self.simulation = simulation
         self.layer = position  # 1, 2, 3, ... this has no meaning in a freeroute simulation!
         self.corrupt = corrupt  # corrupt mix or not
-        self.Pmix = []# probability this mix contains the target message
-
-        for i in range(0, self.n_targets):
-            self.Pmix.append(float(0.0))
+        self.Pmix = np.zeros(n_targets)  # probability this mix contains each target message
+        self.rng = simulation.spawn_rng()
+        self.variates = VariateBuffer(self.rng)
 
     def create_dummies(self, dummy_id):
         network_dict = self.simulation.network.network_dict
@@ -30,22 +63,50 @@ class Mix:
                 delays.append(0)
             elif self.layer == layer:
                 route.append(self)
-                delays.append(exponential(self.simulation.mu))
+                delays.append(self.variates.exponential(self.simulation.mu))
             else:
-                route.append(choice(network_dict[layer]))
-                delays.append(exponential(self.simulation.mu))
+                route.append(self.variates.choice(network_dict[layer]))
+                delays.append(self.variates.exponential(self.simulation.mu))
         delays += [0]
-        newstop = sample(list(self.simulation.clientsSet), k=1)[0]
+        newstop = self.variates.choice(self.simulation.clients)
         route += [newstop]
-        pr_target = []
-        for j in range(0, self.n_targets):
-            pr_target.append(float(0.0))
+        pr_target = NO_TARGETS
         new_dummy = Message(dummy_id, 'Dummy', self, route, delays, pr_target, False)
 
         new_dummy.next_hop_index = self.layer + 1
-        new_dummy.id = f'd_{self.id}_{dummy_id}'
         return new_dummy
 
+    def observe_arrival(self, msg):
+        # A corrupt mix sees when a message arrives, whatever its mixing strategy; an honest mix
+        # hides it again, so only the arrival at the start of the current corrupt run is kept
+        if not self.corrupt:
+            msg.corrupt_tail_entered = None
+        elif msg.corrupt_tail_entered is None:
+            msg.corrupt_tail_entered = self.env.now
+
+    def add_probabilities(self, msg):
+        targets, probabilities = msg.pr_target
+        self.Pmix[targets] += probabilities
+
+    def split_probabilities(self, msg, pool_size):
+        # msg leaves with a 1/pool_size share of every target probability the mix holds
+        targets = np.flatnonzero(self.Pmix)
+        probabilities = self.Pmix[targets] / pool_size
+        self.Pmix[targets] -= probabilities
+        msg.pr_target = (targets, probabilities)
+
+    def split_among(self, messages, shares):
+        """
+        Hands messages[k] the fraction shares[k] of the probabilities the mix holds now, all
+        messages at once: one row of the outer product per message.
+        """
+        targets = np.flatnonzero(self.Pmix)
+        held = self.Pmix[targets]
+        probabilities = np.outer(shares, held)
+        self.Pmix[targets] = held * max(0.0, 1.0 - shares.sum())
+        for message, row in zip(messages, probabilities):
+            message.pr_target = (targets, row)
+
     def __str__(self):
         return f'( id: {self.id}, corrupt: {self.corrupt} )'
 
@@ -0,0 +1,151 @@
+import json
+import math
+import os
+import struct
+
+import numpy as np
+
+import BatchTracker
+from BatchTracker import SENT, RECEIVED, CONSTRAINT
+from Metrics import Metrics
+
+# Observation events, as seen by the adversary at the edge of the network:
+#   sent     - message msg_no of incoming batch in_batch left its sender
+#   received - message msg_no arrived at its receiver in outgoing batch out_batch
+#   constraint - corrupt mixes revealed that message msg_no of out_batch is message msg_no of
+#                in_batch (-1 if not), and/or that it left its sender before time (inf if not)
+# in_batch on a received event is the ground truth used for the metrics (-1 if unknown),
+# out_batch = -1 lets the tracker derive the outgoing batch from in_batch, as Client does.
+# A constraint comes before the received event of its message, as the tracker applies it then.
+EVENT_NAMES = {SENT: "sent", RECEIVED: "received", CONSTRAINT: "constraint"}
+EVENT_KINDS = {name: kind for kind, name in EVENT_NAMES.items()}
+
+# Binary records: kind, in_batch, out_batch, msg_no, time (little endian, packed)
+RECORD = struct.Struct("<Biiid")
+EVENT_DTYPE = np.dtype([("kind", "<u1"), ("in_batch", "<i4"), ("out_batch", "<i4"), ("msg_no", "<i4"), ("time", "<f8")])
+assert EVENT_DTYPE.itemsize == RECORD.size
+
+
+def save_trace(path, events):
+    # Same layout as the binary stream, so MatcherService can replay the file directly
+    np.asarray(events, dtype=EVENT_DTYPE).tofile(path)
+
+
+def load_trace(path):
+    return np.fromfile(path, dtype=EVENT_DTYPE)
+
+
+def encode_ndjson(event):
+    kind, in_batch, out_batch, msg_no, time = event
+    if kind == CONSTRAINT:  # only the parts the corrupt mixes revealed
+        line = {"event": EVENT_NAMES[kind], "out_batch": out_batch, "msg_no": msg_no}
+        if in_batch >= 0:
+            line["in_batch"] = in_batch
+        if time < math.inf:
+            line["time"] = time
+        return (json.dumps(line) + "\n").encode()
+    line = {"event": EVENT_NAMES[kind], "in_batch": in_batch, "msg_no": msg_no, "time": time}
+    if kind == RECEIVED:
+        line["out_batch"] = out_batch
+    return (json.dumps(line) + "\n").encode()
+
+
+def decode_ndjson(line):
+    data = json.loads(line)
+    return (EVENT_KINDS[data["event"]], int(data.get("in_batch", -1)), int(data.get("out_batch", -1)),
+            int(data["msg_no"]), float(data.get("time", math.inf)))
+
+
+def encode_binary(event):
+    return RECORD.pack(*event)
+
+
+class EventDecoder:
+    """Turns a byte stream into events, keeping partial lines/records between chunks."""
+
+    def __init__(self, binary=False):
+        self.binary = binary
+        self.buffer = b""
+
+    def feed(self, chunk):
+        data = self.buffer + chunk
+        if self.binary:
+            usable = len(data) - len(data) % RECORD.size
+            self.buffer = data[usable:]
+            return list(RECORD.iter_unpack(data[:usable]))
+        lines = data.split(b"\n")
+        self.buffer = lines.pop()
+        return [decode_ndjson(line) for line in lines if line.strip()]
+
+
+class ObservedMessage:
+    def __init__(self, incoming_batch_id, incoming_msg_id, outgoing_batch_id, outgoing_msg_id):
+        self.incoming_batch_id = incoming_batch_id
+        self.incoming_msg_id = incoming_msg_id
+        self.outgoing_batch_id = outgoing_batch_id
+        self.outgoing_msg_id = outgoing_msg_id
+
+
+class ObservationReplay:
+    """
+    Drives compute_batch_permutations from observation events instead of a running Simulation.
+    The replay stands in for both the receiving client and its simulation (env.now, Metrics,
+    logDir, log_suffix, n_clients, batch_size are all the tracker reads from them). Its logs
+    go to logDir/batch_logs{log_suffix}.csv (or .parquet), apart from the simulation's own; call
+    Metrics.close(logDir, log_suffix) when the replay is done.
+    """
+
+    def __init__(self, logDir="Logs/", n_clients=None, batch_size=None, log_suffix="_replay", log_format="csv"):
+        self.env = self
+        self.simulation = self
+        self.now = 0.0
+        self.logDir = logDir
+        self.log_suffix = log_suffix
+        self.Metrics = Metrics(log_format)
+        self.n_clients = n_clients
+        self.batch_size = batch_size
+        self.events = 0
+        os.makedirs(logDir, exist_ok=True)
+
+    def feed(self, event):
+        kind, in_batch, out_batch, msg_no, time = event
+        self.events += 1
+        if kind == CONSTRAINT:  # time is a bound here, not the time of the observation
+            BatchTracker.add_link_constraint(f"O_{out_batch}_{msg_no}",
+                                             in_msg_id=f"M_{in_batch}_{msg_no}" if in_batch >= 0 else None,
+                                             sent_before=time if time < math.inf else None)
+            return
+        self.now = time
+        if kind == SENT:
+            BatchTracker.record_sent(in_batch, f"M_{in_batch}_{msg_no}", time)
+            return
+        if out_batch < 0:
+            out_batch, _ = BatchTracker.outgoing_batch_for(in_batch)
+        elif in_batch >= 0:
+            BatchTracker.outgoing_to_incoming_batch_map.setdefault(out_batch, in_batch)
+        out_msg_id = f"O_{out_batch}_{msg_no}"
+        BatchTracker.record_received(out_batch, out_msg_id, time)
+        message = ObservedMessage(in_batch if in_batch >= 0 else None,
+                                  f"M_{in_batch}_{msg_no}" if in_batch >= 0 else None,
+                                  out_batch, out_msg_id)
+        BatchTracker.compute_batch_permutations(self, message)
+
+    def feed_many(self, events):
+        for event in events:
+            self.feed(event)
+
+    def feed_array(self, events):
+        """
+        Feeds a structured EVENT_DTYPE array, e.g. a view of shared memory. The field columns
+        are views of it and events are read one element at a time, so the array is not copied.
+        """
+        kinds, in_batches, out_batches, msg_nos, times = (events[field] for field in EVENT_DTYPE.names)
+        for i in range(len(events)):
+            self.feed((int(kinds[i]), int(in_batches[i]), int(out_batches[i]), int(msg_nos[i]), float(times[i])))
+
+    def snapshot(self):
+        return {
+            "time": self.now,
+            "events": self.events,
+            "batch_prob": {out_batch: dict(prob) for out_batch, prob in BatchTracker.batch_prob.items()},
+        }
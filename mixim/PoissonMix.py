@@ -1,10 +1,7 @@
-from random import sample, choice
 from Client import Client
-from Mix import Mix
-from numpy.random import exponential
+from Mix import Mix, IndexedPool
 from Message import Message
-import numpy as np
-import random
+import heapq
 
 global idDummies
 
@@ -12,17 +9,23 @@ global idDummies
 class PoissonMix(Mix):
     def __init__(self, mix_id, simulation, position,link_based_dummies,multiple_hop_dummies, rate_mix_dummies, n_targets, corrupt, pr_mix):
         super().__init__(mix_id, simulation, position, n_targets, corrupt)
-        self.pool = []  # Pool
-        self.neighbors = set()
+        self.pool = IndexedPool(self.variates)  # Pool
+        self.departures = []  # heap of (departure time, order, message)
+        self.departures_scheduled = 0
+        self.wakeup = None  # number of the wakeup pending for the earliest departure
+        self.wakeups = 0
+        self.wakeup_time = None
         self.link_based_dummies = link_based_dummies
         self.multiple_hop_dummies = multiple_hop_dummies
         self.rate_mix_dummies = rate_mix_dummies
         self.pr_mix = pr_mix
         self.pool_dummies = []
         if (self.link_based_dummies or self.multiple_hop_dummies) and (not self.corrupt) and self.layer != self.simulation.n_layers:
-            self.env.process(self.send_dummies())
+            # started once the clients exist, as dummies are addressed to them
+            self.simulation.call_later(0, self.send_dummies, 1)
 
     def receive_message(self, msg):
+        self.observe_arrival(msg)
         if not self.simulation.startAttack:  # if a mix reaches a poolsize of 5 percent higher than the average,
             # the GPA can monitor the network and choose a target message
             clients = self.simulation.n_clients
@@ -62,17 +65,16 @@ class PoissonMix(Mix):
                 if len(self.pool) >= 2:  
                     print(f"[BA Debug] Mix {self.id} is stable => Calling set_stable_mix({self.id - 1})")
                     self.env.process(self.simulation.set_stable_mix(self.id - 1))
-        for i in range(0, self.n_targets):
-            self.Pmix[i] += msg.pr_target[i]
+        self.add_probabilities(msg)
         if msg.target_bool and self.simulation.printing:
             print(f'[Mix {self.id}] Target message arrived at Mix {self.id} at time {self.env.now}. \n [Mix {self.id}] Number of messages inside '
                   f'the pool {len(self.pool)}')
         msg.next_hop_index += 1
         if msg.route[msg.next_hop_index] == None:
-            msg.route[msg.next_hop_index] = random.choice(list(self.neighbors))
+            msg.route[msg.next_hop_index] = self.simulation.network.sample_neighbor(self, self.variates.uniform())
         if msg.type == 'Real':
             self.pool.append(msg)
-            self.env.process(self.send_msg(msg))
+            self.schedule_departure(msg)
         elif msg.type == 'Dummy':
             if self.link_based_dummies:
                 self.drop_dummies(msg)
@@ -81,30 +83,57 @@ class PoissonMix(Mix):
                     self.drop_dummies(msg)
                 elif self.layer != self.simulation.n_layers:
                     self.pool.append(msg)
-                    self.env.process(self.send_msg(msg))
+                    self.schedule_departure(msg)
+
+    def schedule_departure(self, msg):
+        # All departures of the mix share one heap; only its head has a pending timeout
+        delay = msg.delays[self.layer]
+        departure = self.env.now + delay
+        heapq.heappush(self.departures, (departure, self.departures_scheduled, msg))
+        self.departures_scheduled += 1
+        if self.wakeup is None or departure < self.wakeup_time:
+            self.wake_after(delay, departure)
+
+    def wake_after(self, delay, time):
+        # A wakeup replaced by an earlier one still fires, but send_due ignores it
+        self.wakeups += 1
+        self.wakeup = self.wakeups
+        self.wakeup_time = time
+        self.simulation.call_later(delay, self.send_due, self.wakeup)
+
+    def send_due(self, wakeup):
+        if wakeup != self.wakeup:
+            return
+        self.wakeup = None
+        while self.departures and self.departures[0][0] <= self.env.now:
+            self.send_msg(heapq.heappop(self.departures)[2])
+        if self.departures:
+            departure = self.departures[0][0]
+            self.wake_after(departure - self.env.now, departure)
+
     def send_msg(self, msg):
-        yield self.env.timeout(msg.delays[self.layer])
         self.update_probabilities(msg, len(self.pool))
         next_hop_index = msg.route[msg.next_hop_index]
         self.pool.remove(msg)
-        self.env.process(self.simulation.attacker.relay(msg, next_hop_index))
+        self.simulation.attacker.relay(msg, next_hop_index)
  
     def update_probabilities(self, msg, pool_size):
         if not self.corrupt:
-            for j in range(0, self.n_targets):
-                msg.pr_target[j] = self.Pmix[j] / pool_size
-                self.Pmix[j] = self.Pmix[j] - msg.pr_target[j]
+            self.split_probabilities(msg, pool_size)
 
     def drop_dummies(self, msg):
         if self.layer == self.simulation.n_layers:
             self.simulation.Log.dummies_dropped_end_link( msg, self.id)
 
-    def send_dummies(self):
-        dummy_id = 1
-        while True:
-            new_message = self.create_dummies(dummy_id)
-            new_message.creator = self.id
-            self.pool.append(new_message)
-            yield self.env.timeout(exponential(self.rate_mix_dummies))
-            dummy_id += 1
-            self.env.process(self.send_msg(new_message))
\ No newline at end of file
+    def send_dummies(self, dummy_id):
+        # Each dummy waits in the pool for an exponential time before its departure is scheduled
+        new_message = self.create_dummies(dummy_id)
+        new_message.creator = self.id
+        self.pool.append(new_message)
+        self.simulation.call_later(self.variates.exponential(self.rate_mix_dummies), self.dummy_ready,
+                                   (new_message, dummy_id))
+
+    def dummy_ready(self, dummy):
+        new_message, dummy_id = dummy
+        self.schedule_departure(new_message)
+        self.send_dummies(dummy_id + 1)
\ No newline at end of file
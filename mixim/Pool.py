@@ -1,6 +1,6 @@
-from random import sample
 from Client import Client
-from Mix import Mix
+from Mix import Mix, IndexedPool
+import numpy as np
 
 flushed = False  # True if a mix has flushed since the beginning of the simulation
 
@@ -10,18 +10,17 @@ class Pool(Mix):
     def __init__(self, mix_id, simulation, position,threshold, flush_percent,n_targets, corrupt, pr_mix):
         super().__init__(mix_id, simulation, position, n_targets, corrupt)
 
-        self.pool = []
+        self.pool = IndexedPool(self.variates)
         self.pr_mix= pr_mix
-        self.neighbors = []  # mixes in next layer used if routing == 'hopbyhop'
         self.threshold = threshold  # pool threshold
         self.flush_percent = flush_percent
         self.round = 0
 
     def receive_message(self, msg):
+        self.observe_arrival(msg)
         msg.next_hop_index += 1
         self.pool.append(msg)
-        for i in range(0, self.n_targets):
-            self.Pmix[i] += msg.pr_target[i]
+        self.add_probabilities(msg)
         if msg.target_bool and self.simulation.printing:
             print(
                 f'Target message arrived at mix {self.id} at time {self.env.now} and size of the pool{len(self.pool)}')
@@ -34,20 +33,19 @@ class Pool(Mix):
 
     def flush(self):
         flush_amount = int(self.flush_percent * self.threshold)
-        flushing_list = sample(self.pool, k=flush_amount)
+        pool_size = len(self.pool)
+        flushing_list = self.pool.sample_remove(flush_amount)
+        self.update_probabilities(flushing_list, pool_size)
 
+        next_hops = []
         for message in flushing_list:
-            self.update_probabilities(message)
             if not isinstance(message.route[message.next_hop_index], Client) and message.route[message.next_hop_index] is None:
                 # not the last mix, for hop by hop routing
-                message.route[message.next_hop_index] = sample(self.neighbors, k=1)[0]
+                message.route[message.next_hop_index] = self.simulation.network.sample_neighbor(self, self.variates.uniform())
+            next_hops.append(message.route[message.next_hop_index])
+        self.simulation.attacker.relay_batch(flushing_list, next_hops)
 
-            next_hop_index = message.route[message.next_hop_index]
-            self.pool.remove(message)
-            self.env.process(self.simulation.attacker.relay(message, next_hop_index))
-
-    def update_probabilities(self, msg):
+    def update_probabilities(self, flushing_list, pool_size):
+        # Each flushed message takes 1/pool_size of what the mix holds before the flush
         if not self.corrupt:
-            for j in range(0, self.n_targets):
-                msg.pr_target[j] = self.Pmix[j] / len(self.pool)
-                self.Pmix[j] = self.Pmix[j] - msg.pr_target[j]
\ No newline at end of file
+            self.split_among(flushing_list, np.full(len(flushing_list), 1 / pool_size))
\ No newline at end of file
@@ -1,9 +1,7 @@
-link_delay = [0.01, 0.1]
-from BatchTracker import outgoing_batches
-
-
 import numpy as np
 
+LINK_DELAY = 0.05
+
 
 class Attacker:
 
@@ -16,49 +14,55 @@ class Attacker:
         self.n_targets = n_targets
         self.time_stable = 0.0
 
-    def relay(self, msg, receiver):
-        # Choose target message
+    def check_pool_rounds(self):
         if self.simulation.mix_type == 'pool' and len(
                 self.simulation.numberrounds) > self.simulation.n_mixes_per_layer * self.simulation.n_layers:
             self.simulation.startAttack = True
-        if self.var and self.simulation.startAttack and msg.next_hop_index == 1 and (
-                msg.type == 'Real' or msg.type == 'ClientDummy'):
-            if self.n_target_chosen_attacker < self.n_targets:
-                for i in range(0, self.n_targets):
-                    if i == self.n_target_chosen_attacker:
-                        msg.pr_target[i] = float(1.0)
-                    else:
-                        msg.pr_target[i] = float(0.0)
-                msg.target_bool = True
-                self.targetMessage = msg
-                self.n_target_chosen_attacker += 1
-                print(f"n_target_chosen_attacker={self.n_target_chosen_attacker}")
-                if self.n_target_chosen_attacker == 1:
-                    self.time_stable = self.env.now
-                    if self.simulation.printing:
-                        print("Network is stable at: ", self.time_stable)
-                if self.simulation.printing:
-                    print(f"Target message chosen: id={msg.id}, route={msg.route} at time= {self.env.now}")
-                self.var = False
-                yield self.env.timeout(2)
-                self.var = True
 
-        yield self.env.timeout(0.05)  # 'link' delay
-        receiver.receive_message(msg)
-        self.checkEndSim()
+    # Relaying schedules a callback that delivers the message(s) after the link delay; no
+    # process or event is created per hop.
+    def relay_batch(self, messages, receivers):
+        # Messages leaving a mix together cross their links together; none of them is a
+        # fresh client message, so no target is chosen here
+        if not self.simulation.startAttack:
+            self.check_pool_rounds()
+        self.simulation.call_later(LINK_DELAY, self.deliver_batch, (messages, receivers))
 
-    def checkEndSim(self):  # check to end simulation logic
-        # batch algorithm
-        print(f"checking condition ====> len(OUTGOING_BATCHES): {len(outgoing_batches)}")
-        if self.env.now >= (self.simulation.SimDuration + self.simulation.burnout) or (len(outgoing_batches) > 100):
+    def relay(self, msg, receiver):
+        if not self.simulation.startAttack:
+            self.check_pool_rounds()
+        # Choose target message, only while there are targets left to choose
+        if (self.n_target_chosen_attacker < self.n_targets and self.var and self.simulation.startAttack
+                and msg.next_hop_index == 1 and (msg.type == 'Real' or msg.type == 'ClientDummy')):
+            self.choose_target(msg, receiver)
+            return
+        self.simulation.call_later(LINK_DELAY, self.deliver, (msg, receiver))
+
+    def choose_target(self, msg, receiver):
+        msg.pr_target = (np.array([self.n_target_chosen_attacker]), np.array([1.0]))
+        msg.target_bool = True
+        self.targetMessage = msg
+        self.n_target_chosen_attacker += 1
+        print(f"n_target_chosen_attacker={self.n_target_chosen_attacker}")
+        if self.n_target_chosen_attacker == 1:
+            self.time_stable = self.env.now
             if self.simulation.printing:
-                print('Simulation duration limit reached')
-            self.simulation.endEvent.succeed()  # end simulation if time has expired
+                print("Network is stable at: ", self.time_stable)
+        if self.simulation.printing:
+            print(f"Target message chosen: id={msg.id}, route={msg.route} at time= {self.env.now}")
+        # No new target for 2 time units; the target itself is held back as long
+        self.var = False
+        self.simulation.call_later(2, self.release_target, (msg, receiver))
+
+    def release_target(self, hop):
+        self.var = True
+        self.simulation.call_later(LINK_DELAY, self.deliver, hop)
+
+    def deliver(self, hop):
+        msg, receiver = hop
+        receiver.receive_message(msg)
 
-        # previous logic
-        # if self.env.now >= (self.simulation.SimDuration + self.simulation.burnout)and (self.simulation.n_targets == self.n_target_chosen_attacker):
-            # if self.simulation.printing:
-            #         print('Simulation duration limit reached')
-            #     self.simulation.endEvent.succeed()  # end simulation if time has expired
-        
-        
\ No newline at end of file
+    def deliver_batch(self, hops):
+        messages, receivers = hops
+        for msg, receiver in zip(messages, receivers):
+            receiver.receive_message(msg)
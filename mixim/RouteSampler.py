@@ -0,0 +1,101 @@
+import numpy as np
+
+
+def alias_table(weights):
+    """
+    Vose's alias table of a discrete distribution: index i = floor(u * n) is kept with
+    probability prob[i] and replaced by alias[i] otherwise, so a draw costs O(1).
+    """
+    weights = np.asarray(weights, dtype=float)
+    n = len(weights)
+    scaled = weights * n / weights.sum()
+    prob = np.ones(n)
+    alias = np.arange(n)
+    small = [i for i in range(n) if scaled[i] < 1]
+    large = [i for i in range(n) if scaled[i] >= 1]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1 - scaled[s]
+        (small if scaled[l] < 1 else large).append(l)
+    return prob, alias
+
+
+class RouteSampler:
+    """
+    Draws source routes of a layered network as integer arrays of mix indices, many at a time.
+    Mixes are numbered in layer order (Network.mixes); the first hop of a layer is drawn from the
+    layer's alias table, later hops pick a uniform neighbor from the network's Adjacency.
+    """
+
+    def __init__(self, layer_sizes, adjacency, layer_weights=None):
+        self.adjacency = adjacency
+        self.n_layers = len(layer_sizes)
+        self.n_mixes = sum(layer_sizes)
+
+        # Alias tables of all layers side by side; layer l owns [layer_start[l], layer_start[l + 1])
+        self.layer_start = np.concatenate([[0], np.cumsum(layer_sizes)]).astype(np.int64)
+        self.layer_size = np.array(layer_sizes, dtype=np.int64)
+        self.layer_prob = np.ones(self.n_mixes)
+        self.layer_alias = np.arange(self.n_mixes)
+        for l in range(self.n_layers):
+            if layer_weights is not None:
+                start = self.layer_start[l]
+                prob, alias = alias_table(layer_weights[l])
+                self.layer_prob[start:start + len(prob)] = prob
+                self.layer_alias[start:start + len(prob)] = start + alias
+
+    def first_hops(self, rng, layers):
+        """One mix per entry of layers (0-based), drawn with the layer weights."""
+        slot = self.layer_start[layers] + (rng.random(len(layers)) * self.layer_size[layers]).astype(np.int64)
+        return np.where(rng.random(len(layers)) < self.layer_prob[slot], slot, self.layer_alias[slot])
+
+    def walk(self, rng, first, n_hops):
+        """Routes of n_hops mixes starting at first, each later hop a uniform neighbor of the previous."""
+        routes = np.empty((len(first), n_hops), dtype=np.int64)
+        routes[:, 0] = first
+        for hop in range(1, n_hops):
+            routes[:, hop] = self.adjacency.sample_many(routes[:, hop - 1], rng.random(len(first)))
+        return routes
+
+    def stratified(self, rng, size, n_hops=None):
+        """Stratified routes: weighted entry mix in layer 1, then one neighbor per layer."""
+        return self.walk(rng, self.first_hops(rng, np.zeros(size, dtype=np.int64)), n_hops or self.n_layers)
+
+    def cyclic(self, rng, size):
+        """Cyclic stratified routes: as stratified, but entering at a uniformly chosen layer."""
+        layers = rng.integers(self.n_layers, size=size)
+        return self.walk(rng, self.first_hops(rng, layers), self.n_layers)
+
+    def distinct(self, rng, size, n_hops):
+        """Free routes: n_hops distinct mixes chosen uniformly, without rejection sampling."""
+        n = self.n_mixes
+        if n_hops > n:
+            raise ValueError(f"Cannot route over {n_hops} distinct mixes out of {n}")
+        routes = np.empty((size, n_hops), dtype=np.int64)
+        for hop in range(n_hops):
+            # Uniform rank among the n - hop unused mixes, shifted past the used ones in increasing order
+            pick = rng.integers(n - hop, size=size)
+            for used in np.sort(routes[:, :hop], axis=1).T:
+                pick += pick >= used
+            routes[:, hop] = pick
+        return routes
+
+
+class RouteBuffer:
+    """Routes (lists of Mix objects) drawn block-wise by draw(size) and handed out one at a time."""
+
+    def __init__(self, mixes, draw, block=256):
+        self.mixes = mixes
+        self.draw = draw
+        self.block = block
+        self.routes = iter(())
+
+    def next(self):
+        try:
+            return next(self.routes)
+        except StopIteration:
+            mixes = self.mixes
+            self.routes = iter([[mixes[i] for i in route] for route in self.draw(self.block).tolist()])
+            return next(self.routes)
@@ -5,8 +5,10 @@ import pandas as pd
 import numpy as np
 from Relay import Attacker
 from Log import Log
+from FastEnvironment import FastEnvironment, simpy_call_later
 from Metrics import Metrics
 from util import XRD_New
+import BatchTracker
 import os
 
 DEFAULT_TOPOLOGY = 'stratified'
@@ -20,11 +22,16 @@ class Simulation(object):
     def __init__(self, mix_type, simDuration, rate_client, mu, logging, topology, fully_connected, n_clients, n_hops, 
                  flush_percent, printing, flush_timeout, threshold, routing, n_layers,
                  n_mixes_per_layer, corrupt, unifrom_corruption, probability_dist_mixes, nbr_cascacdes, m_barabasi_mixes, client_dummies,
-                 rate_client_dummies, link_based_dummies, multiple_hops_dummies, rate_mix_dummies, Network_template, batch_size):
+                 rate_client_dummies, link_based_dummies, multiple_hops_dummies, rate_mix_dummies, Network_template, batch_size,
+                 engine="simpy", seed=None, log_suffix=None, log_format="csv"):
 
         self.logDir = logDir
+        # appended to every log file name (batch_logs{suffix}.csv, SentMessages{suffix}.npz, ...);
+        # runs sharing a job pass their own, e.g. one per seed
+        self.log_suffix = f"_{os.environ.get('SLURM_JOB_ID', '')}" if log_suffix is None else log_suffix
+        BatchTracker.reset()  # the tracker is module state; start every run in the process from scratch
         self.Log = Log()
-        self.Metrics = Metrics()
+        self.Metrics = Metrics(log_format)  # "parquet" needs pyarrow, see Metrics
         self.logs = []
         self.logging = logging
         self.printing = printing
@@ -43,6 +50,7 @@ class Simulation(object):
         self.n_hops = n_hops
         self.batch_size = batch_size
         self.clientsSet = set()
+        self.clients = []  # clientsSet in id order, see link_clients
         self.rate_client = rate_client  # average delay between messages being sent from client
         self.threshold = threshold
         self.mu = mu  # average delay at poisson mixes
@@ -54,7 +62,20 @@ class Simulation(object):
         self.unifrom_corruption = unifrom_corruption
         self.mix_type = mix_type
         self.routing = routing
-        self.env = simpy.Environment()
+        # engine="fast" runs the same model on the heapq event loop of FastEnvironment. The
+        # per-message work is scheduled through call_later(delay, callback, value): a plain
+        # heap entry on the fast engine, a timeout with a callback on SimPy.
+        if engine == "fast":
+            self.env = FastEnvironment()
+            self.call_later = self.env.call_later
+        else:
+            self.env = simpy.Environment()
+            self.call_later = simpy_call_later(self.env)
+        # All randomness of a run comes from one seed: the network is built from self.rng and
+        # every client and mix draws from its own child stream (spawn_rng), so equal seeds
+        # give identical runs. seed=None takes fresh OS entropy once per run.
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(self.seed_sequence.spawn(1)[0])
         self.SimDuration = simDuration
         self.burnout = 10
         self.flush_timeout = flush_timeout
@@ -68,6 +89,7 @@ class Simulation(object):
             print(f"n_targets={self.n_targets}")
         else:
             self.n_targets = int((self.SimDuration - self.flush_timeout - 1) / 4)
+        self.Metrics.track_targets(self.n_targets)
         self.network = Network(self.mix_type, self.n_layers, self.n_mixes_per_layer, 
                                self.corrupt,self.unifrom_corruption, self, self.threshold,
                                self.flush_percent, self.topology, fully_connected, self.flush_timeout,
@@ -80,17 +102,34 @@ class Simulation(object):
                          self.Log)
         # self.stableMix = [False for i in range(self.n_mixes_per_layer*self.n_layers)]  # only start attack after mixes are stable
         self.stableChains = [False for i in range(1, 1 + 6)]  # only start attack after chains are stable
-        if self.topology == 'stratified':
+        if self.topology in ('stratified', 'free route', 'ba topology'):
+            # free route and BA networks hold all their mixes in layer 1
             self.stableMixL1 = [False for i in range(self.n_mixes_per_layer)]  # only start attack after mixes are stable
         if self.topology == 'cyclic_stratified':
             self.stable_layer = [False] * self.n_layers 
         self.attacker = Attacker(self, self.n_targets)  # attacker/relay object
         self.endEvent = self.env.event()  # event that triggers the end of the simulation
+        # The run ends at the duration limit or once more than max_outgoing_batches outgoing batches exist
+        self.max_outgoing_batches = 100
+        self.n_outgoing_batches = 0
+        self.call_later(self.SimDuration + self.burnout, self.end_simulation)
         self.TargetMessageEnd = False  # if target message has reached the end client
         self.startAttack = False  # if the attacker is allowed to choose a target message
         self.NumberMsgsDropped = 0
         self.numberrounds = []
 
+    def outgoing_batch_opened(self):
+        self.n_outgoing_batches += 1
+        if self.n_outgoing_batches > self.max_outgoing_batches:
+            self.end_simulation()
+
+    def end_simulation(self, value=None):
+        if self.endEvent.triggered:
+            return
+        if self.printing:
+            print('Simulation duration limit reached')
+        self.endEvent.succeed()  # end simulation if time has expired
+
     def set_stable_mix(self, index):
         print(f"[{self.env.now}] Entered set_stable_mix for index={index}")
         if index >= len(self.stableMixL1):
@@ -119,14 +158,23 @@ class Simulation(object):
             yield self.env.timeout(2)
             self.startAttack = True
 
+    def spawn_rng(self):
+        """Independent random generator for a client or mix, derived from the run's seed."""
+        return np.random.default_rng(self.seed_sequence.spawn(1)[0])
+
+    def link_clients(self):
+        # Receivers are drawn by index, so keep clients in id order rather than set order
+        self.clients = sorted(self.clientsSet, key=lambda client: client.id)
+        for client in self.clients:
+            client.other_clients = [other for other in self.clients if other is not client]
+
     def set_clients(self, probabilityDistribution, n_targets, client_dummies, rate_client_dummies, Log):
         if self.topology == 'stratified':
             for client_no in range(self.n_clients):
                 client = Client.Client(self, client_no, self.network.network_dict, self.rate_client, self.mu,
                                        probabilityDistribution, n_targets, self.n_hops, client_dummies, rate_client_dummies, Log, batch_size=self.batch_size)
                 self.clientsSet.add(client)
-            for client in self.clientsSet:
-                client.other_clients = self.clientsSet - {client}
+            self.link_clients()
         
         elif self.topology == 'cyclic_stratified':
             for client_no in range(self.n_clients):
@@ -141,12 +189,12 @@ class Simulation(object):
                     self.n_hops,
                     client_dummies,
                     rate_client_dummies,
-                    Log
+                    Log,
+                    batch_size=self.batch_size
                 )
                 self.clientsSet.add(client)
 
-            for client in self.clientsSet:
-                client.other_clients = self.clientsSet - {client}
+            self.link_clients()
 
         elif self.topology == 'XRD':
             groups_lists = XRD_New(self.network.list_cascades)
@@ -167,8 +215,7 @@ class Simulation(object):
                 client = Client.Client(self, n_client, groups_lists[3], self.rate_client, self.mu,
                                        probabilityDistribution, n_targets, self.n_hops, client_dummies, Log)
                 self.clientsSet.add(client)
-            for client in self.clientsSet:
-                client.otherClients = self.clientsSet - {client}
+            self.link_clients()
 
         elif self.topology == 'free route':
             for client_no in range(self.n_clients):
@@ -183,11 +230,11 @@ class Simulation(object):
                     self.n_hops,
                     client_dummies,
                     rate_client_dummies,
-                    Log
+                    Log,
+                    batch_size=self.batch_size
                 )
                 self.clientsSet.add(client)
-            for client in self.clientsSet:
-                client.other_clients = self.clientsSet - {client}
+            self.link_clients()
 
         elif self.topology == 'ba topology':
             for client_no in range(self.n_clients):
@@ -202,11 +249,11 @@ class Simulation(object):
                     self.n_hops,
                     client_dummies,
                     rate_client_dummies,
-                    Log
+                    Log,
+                    batch_size=self.batch_size
                 )
                 self.clientsSet.add(client)
-            for client in self.clientsSet:
-                client.other_clients = self.clientsSet - {client}
+            self.link_clients()
 
 
 
@@ -252,31 +299,16 @@ class Simulation(object):
             print('----------Simulation Ended---------')
             print('\n')
 
-        self.Metrics.save(logDir, self.env.now)
+        self.Metrics.close(self.logDir, self.log_suffix)
         # Data from Clients(senders and receivers)
-        df_sent_messages = pd.DataFrame(self.Log.sent_messages)
-        df_received_messages = pd.DataFrame(self.Log.received_messages)
-        df_dummies_messages = pd.DataFrame(self.Log.dummy_messages)
-
         if self.logging:
-            df_sent_messages.to_csv(f'{logDir}SentMessages.csv')
-            df_received_messages.to_csv(f'{logDir}ReceivedMessages.csv')
-            df_dummies_messages.to_csv(f'{logDir}DummyMessages.csv')
-        else:
-            pass
+            self.Log.save(self.logDir, self.log_suffix)
 
-        entropy = []
-        for i in range(0, self.n_targets):
-            entropy.append(0.0)
-        tableProb = df_received_messages['MessageTarget'].to_numpy(copy=True)
-        for j in range(0, self.n_targets):
-            for m in range(len(tableProb)):
-                if tableProb[m][j] != 0:
-                    entropy[j] += - tableProb[m][j] * np.log2(tableProb[m][j])
+        entropy = list(self.Metrics.entropy(self.n_targets))
 
         dict_entropy = {'Entropy': entropy}
         df_entropy = pd.DataFrame(dict_entropy)
-        df_entropy.to_csv(f'{logDir}{self.n_layers}layers_{self.n_mixes_per_layer}mixes_player_Entropy.csv')
+        df_entropy.to_csv(f'{self.logDir}{self.n_layers}layers_{self.n_mixes_per_layer}mixes_player_Entropy{self.log_suffix}.csv')
 
         entropy_mean = np.mean(entropy)
         try:
@@ -286,11 +318,8 @@ class Simulation(object):
             entropy_median = 0
             entropy_q25 = 0
 
-        sum_delays = 0
-        for re, le in zip(self.Log.received_messages["MessageTimeReceived"],
-                          self.Log.received_messages["MessageTimeLeft"]):
-            sum_delays += (re - le)
-        average_delay = sum_delays / len(self.Log.received_messages["MessageTimeReceived"])
+        average_delay = np.mean(self.Log.received_messages["MessageTimeReceived"]
+                                - self.Log.received_messages["MessageTimeLeft"])
         if self.printing:
             print('----------Simulation Stats----------')
             print('\n')
@@ -303,9 +332,9 @@ class Simulation(object):
                 'Amount of clients: {}, \n average delay between 2 messages: {}'.format(self.n_clients, self.rate_client))
             # print('Average Latency: {}'.format(latency))
             print("Number of targets chosen", self.n_targets)
-            print('Number of Real messages generated', len(self.Log.sent_messages["MessageID"]))
-            print('Number of Real messages Received', len(self.Log.received_messages["MessageID"]))
-            print('Number of Dummy messages dropped', len(self.Log.dummy_messages["DummyID"]))
+            print('Number of Real messages generated', len(self.Log.sent_messages))
+            print('Number of Real messages Received', len(self.Log.received_messages))
+            print('Number of Dummy messages dropped', len(self.Log.dummy_messages))
             print("Average delay per message", average_delay)
             print('-------------------------------------')
         
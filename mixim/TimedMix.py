@@ -2,6 +2,7 @@
 from random import sample
 from Client import Client
 from Mix import Mix
+import numpy as np
 
 
 class TimedMix(Mix):
@@ -11,10 +12,10 @@ class TimedMix(Mix):
         self.pool = []
         self.flush_timeout = flush_timeout
         self.weight_mix = weight_mix
-        self.neighbors = set()
-        self.env.process(self.flush())
+        self.simulation.call_later(self.flush_timeout, self.flush)
 
     def receive_message(self, msg):
+        self.observe_arrival(msg)
         if not self.simulation.startAttack:
             var1 = self.simulation.env.now > self.flush_timeout  # first time this mix needs to flush messages
             if var1 and self.layer ==1:
@@ -22,26 +23,25 @@ class TimedMix(Mix):
             if all(self.simulation.stableMixL1):
                 for i in range(self.simulation.n_mixes_per_layer):
                     self.simulation.set_stable_mix(i)
-        for i in range(0, self.n_targets):
-            self.Pmix[i] += msg.pr_target[i]
+        self.add_probabilities(msg)
         if msg.target_bool and self.simulation.printing:
             print(
                 f'Target message arrived at mix {self.id} at time {self.env.now} and size of the pool{len(self.pool)}')
         msg.next_hop_index += 1
         self.pool.append(msg)
 
-    def flush(self):
-        while True:
-            yield self.env.timeout(self.flush_timeout)
-            for message in self.pool:
-                self.update_probabilities(message)
-                next_hop_index = message.route[message.next_hop_index]
-                self.env.process(self.simulation.attacker.relay(message, next_hop_index))
-
-            self.pool.clear()
-
-    def update_probabilities(self, message):
+    def flush(self, value=None):
+        # Runs every flush_timeout, rescheduling itself
+        if self.pool:
+            flushed, self.pool = self.pool, []
+            self.update_probabilities(flushed)
+            next_hops = [message.route[message.next_hop_index] for message in flushed]
+            self.simulation.attacker.relay_batch(flushed, next_hops)
+        self.simulation.call_later(self.flush_timeout, self.flush)
+
+    def update_probabilities(self, messages):
+        # The k-th flushed message takes 1/N of what is left after the k before it,
+        # i.e. (1 - 1/N)^k / N of what the mix held (N = len(pool))
         if not self.corrupt:
-            for i in range(0, self.n_targets):
-                message.pr_target[i] = self.Pmix[i] / len(self.pool)
-                self.Pmix[i] = self.Pmix[i] - message.pr_target[i]
+            n = len(messages)
+            self.split_among(messages, (1 / n) * (1 - 1 / n) ** np.arange(n))
@@ -0,0 +1,151 @@
+from collections import namedtuple
+
+import numpy as np
+
+from Adjacency import Adjacency, CompleteAdjacency
+from RouteSampler import RouteSampler
+from util import VariateBuffer
+
+# One mix of a topology: its id, layer (position), corruption, routing weight and XRD chain (or None)
+MixSpec = namedtuple('MixSpec', 'id layer corrupt weight chain')
+
+
+class Topology:
+    """
+    A built network topology without any runtime state: the mixes as MixSpecs in layer order,
+    which mix indices form each layer (or XRD cascade), the Adjacency between them and the
+    RouteSampler tables. It is not modified after building, so one Topology can be passed as
+    Network_template to several Simulations that differ only in seed, batch size, mix type and
+    mix timing; each run only creates its own mix objects from the specs. The parameters it
+    was built from are kept, and Network rejects a template built for another network.
+    """
+
+    def __init__(self, topology, specs, layers, adjacency, layer_weights=None, cascades=None, parameters=None):
+        self.topology = topology
+        self.parameters = parameters or {}
+        self.specs = tuple(specs)
+        self.layers = {layer: tuple(indices) for layer, indices in layers.items()}
+        self.cascades = {chain: tuple(indices) for chain, indices in (cascades or {}).items()}
+        self.adjacency = adjacency
+        self.route_sampler = None if adjacency is None else \
+            RouteSampler([len(self.layers[layer]) for layer in sorted(self.layers)], adjacency, layer_weights)
+
+    @classmethod
+    def build(cls, topology, num_layers, mixes_per_layer, corrupt, unifrom_corruption, fully_connected,
+              probability_dist_mixes, n_cascades, m_barabasi_mixes, rng):
+        parameters = cls.parameters_of(num_layers, mixes_per_layer, corrupt, unifrom_corruption, fully_connected,
+                                       probability_dist_mixes, m_barabasi_mixes)
+        if topology in ('stratified', 'cyclic_stratified'):
+            specs, layers = [], {}
+            n_corrupt = 0
+            for layer in range(1, num_layers + 1):
+                layers[layer] = []
+                c = 0
+                for i in range(mixes_per_layer):
+                    varCorrupt = False
+                    if topology == 'stratified':
+                        if unifrom_corruption:
+                            varCorrupt = c < corrupt / num_layers
+                            c += varCorrupt
+                        elif n_corrupt < corrupt:
+                            varCorrupt = bool(rng.integers(2))
+                            n_corrupt += varCorrupt
+                    layers[layer].append(len(specs))
+                    specs.append(MixSpec(len(specs) + 1, layer, varCorrupt, probability_dist_mixes[layer - 1][i], None))
+            if topology == 'stratified' and not fully_connected:
+                adjacency = Adjacency.empty(len(specs))
+            else:
+                # each layer links to the whole next one, the last layer back to the first
+                adjacency = Adjacency.layered([mixes_per_layer] * num_layers)
+            return cls(topology, specs, layers, adjacency, probability_dist_mixes, parameters=parameters)
+
+        elif topology == 'free route':
+            specs = []
+            n_corrupt = 0
+            for i in range(mixes_per_layer):
+                varCorrupt = False
+                if n_corrupt < corrupt:
+                    # spread corruption over the first mixes, or pick randomly until there are enough
+                    varCorrupt = True if unifrom_corruption else bool(rng.integers(2))
+                    n_corrupt += varCorrupt
+                specs.append(MixSpec(i + 1, 1, varCorrupt, 1.0 / mixes_per_layer, None))
+            # Either all the other mixes if "fully_connected=True", without storing them,
+            # or each mix has k random neighbors
+            if fully_connected:
+                adjacency = CompleteAdjacency(mixes_per_layer)
+            else:
+                # for partial connectivity, pick e.g. 2 random other mixes per mix
+                picks = np.array([rng.choice(mixes_per_layer - 1, 2, replace=False) for _ in range(mixes_per_layer)])
+                picks += picks >= np.arange(mixes_per_layer)[:, None]  # skip the mix itself
+                adjacency = Adjacency.from_csr(np.arange(0, 2 * mixes_per_layer + 1, 2), picks.ravel())
+            return cls(topology, specs, {1: range(mixes_per_layer)}, adjacency, parameters=parameters)
+
+        elif topology == 'ba topology':
+            indptr, indices = ba_adjacency(mixes_per_layer, m_barabasi_mixes, rng)
+            specs = [MixSpec(i + 1, 1, False, 1.0 / mixes_per_layer, None) for i in range(mixes_per_layer)]
+            # mix i + 1 sits at index i, so the adjacency applies as is
+            return cls(topology, specs, {1: range(mixes_per_layer)}, Adjacency.from_csr(indptr, indices),
+                       parameters=parameters)
+
+        elif topology == 'XRD':
+            specs, cascades = [], {}
+            for chain in range(1, 1 + n_cascades):
+                cascades[chain] = []
+                for m in range(num_layers):
+                    cascades[chain].append(len(specs))
+                    specs.append(MixSpec(len(specs) + 1, m + 1, False, 1 / n_cascades, chain))
+            return cls(topology, specs, {}, None, cascades=cascades, parameters=parameters)
+
+        raise ValueError(f"Unknown topology {topology!r}")
+
+    @staticmethod
+    def parameters_of(num_layers, mixes_per_layer, corrupt, unifrom_corruption, fully_connected,
+                      probability_dist_mixes, m_barabasi_mixes):
+        """The build parameters a run must share with a template it reuses."""
+        return {
+            "num_layers": num_layers,
+            "mixes_per_layer": mixes_per_layer,
+            "corrupt": corrupt,
+            "unifrom_corruption": unifrom_corruption,
+            "fully_connected": fully_connected,
+            "weights": tuple(tuple(layer) for layer in probability_dist_mixes),
+            "m_barabasi_mixes": m_barabasi_mixes,
+        }
+
+    def check_compatible(self, topology, parameters):
+        """Raises ValueError unless a run with this topology and these build parameters can use the template."""
+        if topology != self.topology:
+            raise ValueError(f"Network_template is a {self.topology!r} topology, not {topology!r}")
+        different = [f"{name}={parameters[name]!r} (template: {self.parameters.get(name)!r})"
+                     for name in parameters if parameters[name] != self.parameters.get(name)]
+        if different:
+            raise ValueError(f"Network_template was built for another network: {', '.join(different)}")
+
+
+def ba_adjacency(N, m, rng):
+    """
+    Barabasi-Albert graph as CSR arrays (indptr, indices): node i's neighbors are
+    indices[indptr[i]:indptr[i + 1]]. It starts from a complete graph on m nodes, and each new
+    node links to m distinct existing nodes with probability proportional to their degree.
+    A degree-proportional draw is a uniform pick from the list of all edge endpoints, in which
+    every node appears once per edge (repeated-nodes method), so a node costs O(m).
+    """
+    if m < 1 or m >= N:
+        raise ValueError("BA-topology parameter m must be in [1, N-1].")
+    variates = VariateBuffer(rng, block=1 << 16)
+
+    # endpoints of every edge so far, two entries per edge; starts with the complete graph of m nodes
+    ends = [node for i in range(m) for j in range(i + 1, m) for node in (i, j)]
+    for new_node in range(m, N):
+        connected = set()
+        while len(connected) < m:
+            # with m = 1 the first node has no edge yet, so it is taken uniformly
+            connected.add(variates.choice(ends) if ends else variates.integer(new_node))
+        for cand in connected:
+            ends += (new_node, cand)
+
+    ends = np.array(ends, dtype=np.int64).reshape(-1, 2)
+    source = np.concatenate([ends[:, 0], ends[:, 1]])
+    target = np.concatenate([ends[:, 1], ends[:, 0]])
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(source, minlength=N))])
+    return indptr, target[np.argsort(source, kind="stable")]
@@ -0,0 +1,90 @@
+import logging
+import time
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+import BatchTracker
+from Observation import EVENT_DTYPE, ObservationReplay, save_trace
+
+
+def record_trace(simulation, until=None):
+    """Runs the simulation once with the matcher switched off and returns its observation events."""
+    BatchTracker.observation_log = []
+    BatchTracker.tracking = False
+    try:
+        simulation.run(until)
+        return np.array(BatchTracker.observation_log, dtype=EVENT_DTYPE)
+    finally:
+        BatchTracker.observation_log = None
+        BatchTracker.tracking = True
+
+
+def run_analysis(shm_name, n_events, config, logDir, n_clients, batch_size):
+    """
+    Worker: replays the shared trace through a tracker configured by `config`, a dict holding
+    a "name" plus BatchTracker module settings (e.g. window_size, metrics_save_interval).
+    Each analysis writes its batch logs under its own logDir/<name>/.
+    """
+    settings = dict(config)
+    name = settings.pop("name")
+    BatchTracker.reset()
+    BatchTracker.logger.setLevel(logging.WARNING)
+    for setting, value in settings.items():
+        if not hasattr(BatchTracker, setting):
+            raise ValueError(f"Unknown BatchTracker setting '{setting}' in analysis '{name}'")
+        setattr(BatchTracker, setting, value)
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    events = np.ndarray((n_events,), dtype=EVENT_DTYPE, buffer=shm.buf)  # view, no copy
+    try:
+        replay = ObservationReplay(f"{logDir}{name}/", n_clients, batch_size)
+        start = time.perf_counter()
+        replay.feed_array(events)
+        seconds = time.perf_counter() - start
+    finally:
+        events = None  # release the view before detaching
+        shm.close()
+    replay.Metrics.close(replay.logDir, replay.log_suffix)
+    return {
+        "name": name,
+        "events": n_events,
+        "seconds": seconds,
+        "events_per_sec": n_events / seconds if seconds > 0 else 0.0,
+        "batch_logs": len(replay.Metrics.batch_logs),
+    }
+
+
+def fan_out(trace, configs, logDir="Logs/", n_clients=None, batch_size=None, processes=None):
+    """
+    Sends one recorded trace to several tracker configurations, one worker process each.
+    The trace is placed in shared memory once and every worker reads it in place.
+    """
+    trace = np.asarray(trace, dtype=EVENT_DTYPE)
+    shm = shared_memory.SharedMemory(create=True, size=max(trace.nbytes, 1))
+    try:
+        np.ndarray(trace.shape, dtype=EVENT_DTYPE, buffer=shm.buf)[:] = trace
+        jobs = [(shm.name, len(trace), config, logDir, n_clients, batch_size) for config in configs]
+        with Pool(processes=processes or len(configs), maxtasksperchild=1) as pool:
+            return pool.starmap(run_analysis, jobs, chunksize=1)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+if __name__ == "__main__":
+    from main import create_simulation
+
+    simulation = create_simulation()
+    trace = record_trace(simulation)
+    save_trace(f"{simulation.logDir}observations.bin", trace)
+    print(f"Recorded {len(trace)} observation events")
+
+    configs = [
+        {"name": "exact", "window_size": 1},
+        {"name": "window_5", "window_size": 5},
+        {"name": "window_10", "window_size": 10},
+    ]
+    for result in fan_out(trace, configs, simulation.logDir, simulation.n_clients, simulation.batch_size):
+        print(f"{result['name']}: {result['events']} events in {result['seconds']:.2f}s "
+              f"({result['events_per_sec']:.1f} events/sec), {result['batch_logs']} batch log rows")
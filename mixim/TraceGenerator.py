@@ -0,0 +1,87 @@
+import configparser
+import sys
+import time
+
+import numpy as np
+
+from Observation import EVENT_DTYPE, save_trace
+from BatchTracker import SENT, RECEIVED
+from Relay import LINK_DELAY
+
+
+def generate_trace(n_clients, batch_size, lambda_c=1.0, mu=1.0, n_hops=3, duration=None, n_batches=None, seed=None):
+    """
+    Observation trace of a source-routed Poisson-mix network in closed form, without simulating it.
+    As in Client.send_message, every client sends batches of batch_size messages with exponential
+    gaps (mean 1/lambda_c). A Poisson mix holds each message for an independent exponential delay
+    (mean mu), so a message arrives after the sum of n_hops such delays (a Gamma(n_hops, mu)
+    variate) plus n_hops + 1 link delays.
+
+    Either duration (sim time, messages sent after it are dropped) or n_batches per client must be
+    given. Returns EVENT_DTYPE records sorted by time. Incoming batch ids follow the order in which
+    clients claim batches, outgoing batch ids the order in which batches first reach their receiver,
+    as BatchTracker assigns them.
+    """
+    if (duration is None) == (n_batches is None):
+        raise ValueError("Give exactly one of duration and n_batches")
+    rng = np.random.default_rng(seed)
+    if n_batches is None:
+        expected = duration * lambda_c
+        n_batches = int(np.ceil((expected + 6 * np.sqrt(expected) + 1) / batch_size))
+    n_messages = n_batches * batch_size
+
+    sent = np.cumsum(rng.exponential(1 / lambda_c, (n_clients, n_messages)), axis=1)
+    received = sent + (n_hops + 1) * LINK_DELAY
+    if n_hops > 0:
+        received += rng.gamma(n_hops, mu, (n_clients, n_messages))
+
+    # A client claims its next batch id when it starts waiting for the batch's first message,
+    # i.e. when the previous message left
+    claimed = np.concatenate([np.zeros((n_clients, 1)), sent[:, :-1]], axis=1)[:, ::batch_size]
+    batch_order = np.argsort(claimed, axis=None, kind="stable")
+    in_batch = np.empty(batch_order.size, dtype=np.int64)
+    in_batch[batch_order] = np.arange(batch_order.size)
+    in_batch = np.repeat(in_batch.reshape(n_clients, n_batches), batch_size, axis=1)
+    msg_no = np.broadcast_to(np.arange(n_messages) % batch_size, (n_clients, n_messages))
+
+    keep = sent <= duration if duration is not None else np.ones(sent.shape, dtype=bool)
+    sent, received, in_batch, msg_no = sent[keep], received[keep], in_batch[keep], msg_no[keep]
+
+    # Outgoing batch ids in order of each incoming batch's first arrival
+    by_arrival = np.argsort(received, kind="stable")
+    batches, first = np.unique(in_batch[by_arrival], return_index=True)
+    out_of_in = np.empty(in_batch.max() + 1 if in_batch.size else 0, dtype=np.int64)
+    out_of_in[batches[np.argsort(first, kind="stable")]] = np.arange(batches.size)
+
+    n = sent.size
+    events = np.empty(2 * n, dtype=EVENT_DTYPE)
+    events["kind"] = np.repeat([SENT, RECEIVED], n)
+    events["in_batch"] = np.tile(in_batch, 2)
+    events["out_batch"] = np.concatenate([np.full(n, -1), out_of_in[in_batch]])
+    events["msg_no"] = np.tile(msg_no, 2)
+    events["time"] = np.concatenate([sent, received])
+    return events[np.argsort(events["time"], kind="stable")]
+
+
+def trace_batches(trace):
+    """incoming_batches / outgoing_batches dicts (BatchTracker's layout) of a generated trace."""
+    incoming_batches, outgoing_batches = {}, {}
+    for kind, in_batch, out_batch, msg_no, t in trace.tolist():
+        if kind == SENT:
+            incoming_batches.setdefault(in_batch, {})[f"M_{in_batch}_{msg_no}"] = t
+        elif kind == RECEIVED:
+            outgoing_batches.setdefault(out_batch, {})[f"O_{out_batch}_{msg_no}"] = t
+    return incoming_batches, outgoing_batches
+
+
+if __name__ == "__main__":
+    # Trace for the clients of ConfigFile.ini; duration in sim seconds (default: 12 hours)
+    config = configparser.ConfigParser()
+    config.read('ConfigFile.ini')
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 12 * 3600
+    start = time.perf_counter()
+    trace = generate_trace(int(config['DEFAULT']['n_clients']), int(config['DEFAULT']['batch_size']),
+                           float(config['DEFAULT']['lambda_c']), float(config['MIXING']['mu']),
+                           int(config['DEFAULT']['n_hops']), duration=duration)
+    print(f"Generated {len(trace)} events for {duration:.0f}s of sim time in {time.perf_counter() - start:.2f}s")
+    save_trace('Logs/observations_generated.bin', trace)
@@ -2,6 +2,7 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 from pathlib import Path
+from Metrics import read_batch_logs
 import glob
 
 def load_and_analyze_batch_size_impact():
@@ -52,7 +53,7 @@ def load_and_analyze_batch_size_impact():
             print(f"    Found: {csv_file.name}")
             
             # Load and process the file
-            df = pd.read_csv(csv_file)
+            df = read_batch_logs(csv_file)
             
             # Get data from the largest window index only
             max_window = df['window_index'].max()
@@ -3,11 +3,12 @@ import time
 from multiprocessing import Pool
 from util import Weights
 import configparser
+import os
 
-def main(rate):
+def create_simulation(config_file='ConfigFile.ini', engine='simpy', seed=None, network_template=None, log_suffix=None):
 
     config = configparser.ConfigParser()
-    config.read('ConfigFile.ini')
+    config.read(config_file)
 
     topology_vars = config['TOPOLOGY']
     topology = topology_vars['type']
@@ -50,6 +51,9 @@ def main(rate):
     multiple_hops_dummies = dummies_vars.getboolean('multiple_hop_dummies')
     rate_mix_dummies =float(dummies_vars['rate_mix_dummies'])
 
+    # Batch log format: csv, or parquet (needs the optional pyarrow, falls back to csv without it)
+    log_format = config.get('LOGGING', 'log_format', fallback='csv')
+
 
 
     weights = Weights(n_layer, n_mix_per_layer)
@@ -59,8 +63,26 @@ def main(rate):
                             n_mixes_per_layer=n_mix_per_layer,corrupt= corrupt_mixes,unifrom_corruption= balanced_corruption,
                             probability_dist_mixes=weights,nbr_cascacdes = n_cascade, m_barabasi_mixes = m_barabasi_mixes, client_dummies=client_dummies,
                             rate_client_dummies = rate_client_dummies, link_based_dummies = link_dummies, multiple_hops_dummies = multiple_hops_dummies,
-                            rate_mix_dummies = rate_mix_dummies, Network_template=None, batch_size=batch_size)
+                            rate_mix_dummies = rate_mix_dummies, Network_template=network_template, batch_size=batch_size,
+                            engine=engine, seed=seed, log_suffix=log_suffix, log_format=log_format)
+    return simulation
+
+def run_seeds(seeds, config_file='ConfigFile.ini'):
+    # Runs in one worker share the topology built by the first; each only creates its mixes and clients
+    # and writes its logs under its own suffix, so the seeds do not overwrite each other's files
+    job = os.environ.get('SLURM_JOB_ID', '')
+    template = None
+    results = []
+    for seed in seeds:
+        simulation = create_simulation(config_file, seed=seed, network_template=template,
+                                       log_suffix=f"_{job}_seed{seed}")
+        template = simulation.network.template
+        results.append(simulation.run())
+    return results
+
+def main(rate):
 
+    simulation = create_simulation()
     now = time.time()
     entropy, entropy_mean, entropy_median , entropy_q25= simulation.run()
     if simulation.printing:
@@ -2,6 +2,7 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 from pathlib import Path
+from Metrics import read_batch_logs
 import seaborn as sns
 
 def analyze_temporal_changes(csv_file_path):
@@ -9,7 +10,7 @@ def analyze_temporal_changes(csv_file_path):
     Analyze temporal changes for a single CSV file
     """
     # Load the data
-    df = pd.read_csv(csv_file_path)
+    df = read_batch_logs(csv_file_path)
     
     # Extract metadata from filename
     filename = Path(csv_file_path).stem
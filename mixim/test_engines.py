@@ -0,0 +1,40 @@
+import configparser
+import os
+
+import numpy as np
+import pytest
+
+import BatchTracker
+from EngineComparison import run_once
+
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ConfigFile.ini')
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch, request):
+    # Runs write their logs to Logs/ under the working directory
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'Logs').mkdir()
+    config = configparser.ConfigParser()
+    config.read(CONFIG)
+    config['MIXING']['mix_type'] = request.param
+    config['MIXING']['threshold'] = '10'  # pool mixes flush every 10 messages, so a short run sees many flushes
+    path = tmp_path / 'ConfigFile.ini'
+    with open(path, 'w') as f:
+        config.write(f)
+    return str(path)
+
+
+@pytest.mark.parametrize('config_file', ['poisson', 'time', 'pool'], indirect=True)
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_engines_give_identical_runs(config_file, seed):
+    # Same seed, same model: the fast engine must replay the SimPy run event for event
+    simpy_run = run_once('simpy', seed, config_file)
+    fast_run = run_once('fast', seed, config_file)
+    assert simpy_run['received'] > 0
+    assert fast_run['events'] == simpy_run['events']
+    assert fast_run['sent'] == simpy_run['sent']
+    assert fast_run['received'] == simpy_run['received']
+    assert np.array_equal(fast_run['latencies'], simpy_run['latencies'])
+    assert np.array_equal([fast_run['entropy_mean']], [simpy_run['entropy_mean']], equal_nan=True)
+    assert BatchTracker.tracking  # run_once switches the matcher off only for its own run
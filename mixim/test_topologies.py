@@ -0,0 +1,65 @@
+import configparser
+import contextlib
+import io
+import os
+
+import pytest
+
+import BatchTracker
+from main import create_simulation
+
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ConfigFile.ini')
+
+
+def write_config(tmp_path, **topology):
+    config = configparser.ConfigParser()
+    config.read(CONFIG)
+    config['TOPOLOGY'].update(topology)
+    config_file = tmp_path / 'ConfigFile.ini'
+    with open(config_file, 'w') as f:
+        config.write(f)
+    return str(config_file)
+
+
+@pytest.mark.parametrize('topology, routing', [
+    ('stratified', 'source'),
+    ('stratified', 'hopbyhop'),
+    ('cyclic_stratified', 'source'),
+    ('free route', 'source'),
+    ('free route', 'hopbyhop'),
+    ('ba topology', 'source'),
+])
+def test_topology_runs_end_to_end(topology, routing, tmp_path, monkeypatch):
+    # Short seeded run of each routing path, with the matcher off; it must deliver messages
+    # and let the attacker start once the mixes are stable
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'Logs').mkdir()
+    config_file = write_config(tmp_path, type=topology, routing=routing, n_layers='3', l_mixes_per_layer='6',
+                               m_fully_connected_mixes='2')
+
+    tracking = BatchTracker.tracking
+    BatchTracker.tracking = False
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            simulation = create_simulation(config_file, engine='fast', seed=0)
+            simulation.printing = False
+            simulation.max_outgoing_batches = float('inf')
+            simulation.run(40)
+    finally:
+        BatchTracker.tracking = tracking
+    assert len(simulation.Log.received_messages) > 0
+    assert simulation.startAttack
+
+
+def test_network_template_must_match_the_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'Logs').mkdir()
+    with contextlib.redirect_stdout(io.StringIO()):
+        template = create_simulation(write_config(tmp_path, n_layers='3', l_mixes_per_layer='3'), seed=0).network.template
+        # same network, another seed: the template is reused
+        simulation = create_simulation(write_config(tmp_path, n_layers='3', l_mixes_per_layer='3'), seed=1,
+                                       network_template=template)
+        assert simulation.network.template is template
+        with pytest.raises(ValueError, match='num_layers=1'):
+            create_simulation(write_config(tmp_path, n_layers='1', l_mixes_per_layer='1'), seed=1,
+                              network_template=template)
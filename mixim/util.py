@@ -38,5 +38,90 @@ def Weights (Number_layer, Number_Mix_Per_Layer):
     return probability
 
 
+class GrowableArray:
+    """Append-only NumPy array that doubles its capacity when full; view() exposes the filled part without copying."""
 
+    def __init__(self, dtype, capacity=1024):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
 
+    def __len__(self):
+        return self.size
+
+    def reserve(self, size):
+        if size > len(self.data):
+            grown = np.empty(max(size, 2 * len(self.data)), dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+
+    def append(self, value):
+        if self.size == len(self.data):
+            self.reserve(self.size + 1)
+        self.data[self.size] = value
+        self.size += 1
+
+    def extend(self, values):
+        end = self.size + len(values)
+        self.reserve(end)
+        self.data[self.size:end] = values
+        self.size = end
+
+    def view(self, start=0, stop=None):
+        return self.data[start:self.size if stop is None else stop]
+
+
+class RaggedArray:
+    """Variable-length rows stored as one flat GrowableArray plus row offsets (CSR layout)."""
+
+    def __init__(self, dtype, capacity=1024):
+        self.offsets = GrowableArray(np.int64, capacity + 1)
+        self.offsets.append(0)
+        self.values = GrowableArray(dtype, 4 * capacity)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def append(self, row):
+        self.values.extend(row)
+        self.offsets.append(len(self.values))
+
+    def view(self):
+        return self.offsets.view(), self.values.view()
+
+    def rows(self):
+        offsets, values = self.view()
+        return np.split(values, offsets[1:-1])
+
+
+class VariateBuffer:
+    """
+    Exponential and uniform variates of a Generator, drawn in vectorised blocks and handed out
+    one at a time, so per-message sampling takes the next buffered value instead of a NumPy call.
+    """
+
+    def __init__(self, rng, block=1024):
+        self.rng = rng
+        self.block = block
+        self.exponentials = iter(())
+        self.uniforms = iter(())
+
+    def exponential(self, scale=1.0):
+        try:
+            return scale * next(self.exponentials)
+        except StopIteration:
+            self.exponentials = iter(self.rng.standard_exponential(self.block).tolist())
+            return scale * next(self.exponentials)
+
+    def uniform(self):
+        try:
+            return next(self.uniforms)
+        except StopIteration:
+            self.uniforms = iter(self.rng.random(self.block).tolist())
+            return next(self.uniforms)
+
+    def integer(self, n):
+        """Uniform integer in [0, n)."""
+        return min(int(self.uniform() * n), n - 1)
+
+    def choice(self, seq):
+        return seq[self.integer(len(seq))]